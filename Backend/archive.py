@@ -0,0 +1,103 @@
+import os, io, time, zipfile, hashlib
+import metrics
+import media_layout
+from thumbnails import IMAGE_EXTENSIONS, VIDEO_EXTENSIONS
+
+CHUNK_SIZE = 64 * 1024
+FLUSH_SIZE = 256 * 1024
+# Already compressed; deflating them again costs the Pi CPU and saves next to nothing
+STORED_EXTENSIONS = IMAGE_EXTENSIONS + VIDEO_EXTENSIONS + (".pdf", ".zip")
+# ZIP timestamps can't go below 1980
+_ZIP_EPOCH = time.mktime((1980, 1, 1, 0, 0, 0, 0, 0, -1))
+
+
+class _ZipSink(io.RawIOBase):
+    """Write-only, unseekable file object: zipfile streams into it (local headers plus data
+    descriptors) and the response generator drains it between chunks."""
+
+    def __init__(self):
+        self._chunks = []
+        self.pending = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.pending += len(data)
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self.pending = 0
+        return data
+
+
+def folder_entries(media_root, folder_name):
+    """(name in the archive, path, stat) for every file of one work-order folder.
+
+    Hidden entries (.derivatives, .uploads) and half-written uploads (*.part) are left out.
+    """
+    folder_path = media_layout.folder_path(media_root, folder_name)
+    entries = []
+    for root, dirs, files in os.walk(folder_path):
+        metrics.dir_scan()
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(files):
+            if name.startswith(".") or name.endswith(".part"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            relative = os.path.relpath(path, folder_path).replace(os.sep, "/")
+            entries.append((f"{folder_name}/{relative}", path, stat))
+    return entries
+
+
+def fingerprint(entries):
+    """ETag and Last-Modified for an archive of these entries.
+
+    The ZIP bytes depend only on names, sizes, mtimes and contents, so this is a strong ETag.
+    """
+    digest = hashlib.sha1()
+    last_modified = None
+    for arcname, _, stat in entries:
+        digest.update(f"{arcname}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+        last_modified = max(last_modified or 0, stat.st_mtime)
+    return f'"{digest.hexdigest()}"', last_modified
+
+
+def stream_zip(entries):
+    """Yield a ZIP of the entries chunk by chunk, without temp files or the archive in memory.
+
+    JPEG/MP4/PDF go in stored, everything else (the JSON) deflated. Files removed since they
+    were listed are skipped.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w") as zf:
+        for arcname, path, stat in entries:
+            try:
+                source = open(path, "rb")
+            except FileNotFoundError:
+                continue
+            info = zipfile.ZipInfo(arcname, time.localtime(max(stat.st_mtime, _ZIP_EPOCH))[:6])
+            info.compress_type = zipfile.ZIP_STORED if arcname.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+            info.file_size = stat.st_size  # lets zipfile pick ZIP64 headers up front for huge videos
+            with source, zf.open(info, "w") as dest:
+                while chunk := source.read(CHUNK_SIZE):
+                    dest.write(chunk)
+                    metrics.fs_read(len(chunk))
+                    if sink.pending >= FLUSH_SIZE:
+                        yield sink.drain()
+            if sink.pending:
+                yield sink.drain()
+    yield sink.drain()
+
+
+def workorders_entries(media_root, folder_names):
+    # One folder listed at a time, so a month of jobs costs the same memory as one job
+    for folder_name in folder_names:
+        yield from folder_entries(media_root, folder_name)
@@ -0,0 +1,177 @@
+import re
+import threading
+from bisect import bisect_left, insort
+from models import Part, Travel
+
+_WORD_START = re.compile(r"(?<![a-z0-9])[a-z0-9]")
+
+
+def _normalize(text):
+    return " ".join(str(text).lower().split())
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class AutocompleteIndex:
+    """Ranked prefix / word-start / substring lookup over a few text fields per record.
+
+    Matches are ranked: whole-field prefix first, then a match at the start of any word,
+    then any substring. Ties break alphabetically on the matched text.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._records = {}   # id -> payload returned to clients
+        self._texts = {}     # id -> normalized texts indexed for that id
+        self._prefixes = []  # sorted (text, id): whole-field prefix matches
+        self._words = []     # sorted (suffix at word start, id): word-start matches
+        self._grams = {}     # trigram -> sorted (text, id) containing it: substring candidates
+
+    def __len__(self):
+        return len(self._records)
+
+    def build(self, items):
+        """Replace the contents with (id, record, texts) tuples in one pass."""
+        with self._lock:
+            self._records.clear()
+            self._texts.clear()
+            prefixes, words = [], []
+            for key, record, texts in items:
+                normalized = self._store(key, record, texts)
+                for text in normalized:
+                    prefixes.append((text, key))
+                    words.extend((text[m.start():], key) for m in _WORD_START.finditer(text) if m.start())
+            prefixes.sort()
+            words.sort()
+            # Filled from the sorted prefixes, so every trigram list comes out sorted too
+            grams = {}
+            for entry in prefixes:
+                for gram in _trigrams(entry[0]):
+                    grams.setdefault(gram, []).append(entry)
+            self._prefixes = prefixes
+            self._words = words
+            self._grams = grams
+
+    def add(self, key, record, texts):
+        with self._lock:
+            self.remove(key)
+            for text in self._store(key, record, texts):
+                insort(self._prefixes, (text, key))
+                for gram in _trigrams(text):
+                    insort(self._grams.setdefault(gram, []), (text, key))
+                for m in _WORD_START.finditer(text):
+                    if m.start():
+                        insort(self._words, (text[m.start():], key))
+
+    def remove(self, key):
+        with self._lock:
+            if key not in self._records:
+                return
+            del self._records[key]
+            for text in self._texts.pop(key):
+                self._discard(self._prefixes, (text, key))
+                for m in _WORD_START.finditer(text):
+                    if m.start():
+                        self._discard(self._words, (text[m.start():], key))
+                for gram in _trigrams(text):
+                    entries = self._grams.get(gram)
+                    if entries is not None:
+                        self._discard(entries, (text, key))
+                        if not entries:
+                            del self._grams[gram]
+
+    def search(self, query, limit=20):
+        q = _normalize(query)
+        if not q:
+            return []
+
+        with self._lock:
+            found = []
+            seen = set()
+            for entries in (self._prefixes, self._words):
+                for _, key in self._scan(entries, q):
+                    if key not in seen:
+                        seen.add(key)
+                        found.append(key)
+                        if len(found) >= limit:
+                            return [self._records[k] for k in found]
+
+            if len(q) >= 3:
+                found.extend(self._substring(q, seen, limit - len(found)))
+            return [self._records[k] for k in found]
+
+    def _store(self, key, record, texts):
+        normalized = tuple({_normalize(t) for t in texts if t})
+        self._records[key] = record
+        self._texts[key] = normalized
+        return normalized
+
+    @staticmethod
+    def _discard(entries, item):
+        i = bisect_left(entries, item)
+        if i < len(entries) and entries[i] == item:
+            del entries[i]
+
+    @staticmethod
+    def _scan(entries, q):
+        i = bisect_left(entries, (q,))
+        while i < len(entries) and entries[i][0].startswith(q):
+            yield entries[i]
+            i += 1
+
+    def _substring(self, q, seen, limit):
+        # Every text containing q is in the list of its rarest trigram, already in rank order,
+        # so the walk stops at `limit` instead of ranking every candidate
+        lists = [self._grams.get(g) for g in _trigrams(q)]
+        if not all(lists):
+            return []
+        found = []
+        for text, key in min(lists, key=len):
+            if q in text and key not in seen and key not in found:
+                found.append(key)
+                if len(found) >= limit:
+                    break
+        return found
+
+
+parts_index = AutocompleteIndex()
+travel_index = AutocompleteIndex()
+
+
+def part_record(part):
+    return {
+        "part_id": part.part_id,
+        "part_name": part.part_name,
+        "part_number": part.part_number,
+        "unit_cost": part.unit_cost,
+        "unit_price": part.unit_price,
+        "part_pic": part.part_pic
+    }
+
+
+def travel_record(travel):
+    return {
+        "location": travel.location,
+        "travel_time_hours": travel.travel_time_hours
+    }
+
+
+def index_part(part):
+    parts_index.add(part.part_id, part_record(part), (part.part_name, part.part_number))
+
+
+def index_travel(travel):
+    travel_index.add(travel.id, travel_record(travel), (travel.location,))
+
+
+def load_indexes(db):
+    parts_index.build(
+        (part.part_id, part_record(part), (part.part_name, part.part_number))
+        for part in db.query(Part).yield_per(5000)
+    )
+    travel_index.build(
+        (travel.id, travel_record(travel), (travel.location,))
+        for travel in db.query(Travel).yield_per(5000)
+    )
@@ -0,0 +1,544 @@
+"""Reproducible benchmark / load test for every route in main.py.
+
+Generates a synthetic media tree and parts/travel catalogue, drives each endpoint through
+an in-process ASGI client (or a live server with --url) at a fixed concurrency, and writes
+p50/p95/p99 latency, throughput and peak RSS per endpoint to JSON. With --baseline the run
+is compared against an earlier result and exits non-zero on regressions.
+
+    python benchmark.py run --folders 1000 --parts 100000 --requests 200 --concurrency 8
+    python benchmark.py run --folders 20000 --baseline bench_results/last.json --max-regression 0.25
+    python benchmark.py generate --folders 100000 --media-root /mnt/ssd/bench-media
+"""
+import os, io, sys, csv, json, time, random, asyncio, logging, argparse, platform, threading, tempfile, resource
+from collections import Counter
+from datetime import date, timedelta
+from itertools import count
+from urllib.parse import quote
+
+TECHNICIANS = ["Vidy", "Subas"]
+CUSTOMERS = [
+    "Arcelormittal Tailored Blanks", "Magna Seating", "Maple Leaf Foods", "Canada Post",
+    "Loblaws DC", "Brampton Civic Hospital", "Purolator Hub", "Peel Region Water",
+]
+CITIES = [
+    "Brampton", "Burlington", "Concord", "Etobicoke", "Mississauga", "Oakville", "Toronto",
+    "Vaughan", "Markham", "Milton", "Hamilton", "Scarborough", "North York", "Bolton",
+]
+WORDS = (
+    "replaced breaker panel tested circuit installed conduit pulled wire ballast fixture "
+    "troubleshot motor starter overload relay dock leveler door opener photocell timer "
+    "grounded bonded labelled disconnect receptacle gfci emergency lighting exit sign"
+).split()
+PART_WORDS = (
+    "WIRE CABLE BREAKER FUSE RELAY CONTACTOR CONNECTOR CONDUIT COUPLING STRAP BOX COVER "
+    "SWITCH SENSOR TIMER BALLAST LAMP FIXTURE RECEPTACLE PLUG BUSHING FITTING"
+).split()
+START_DATE = date(2025, 6, 30)
+FOLDER_BASE = 7_000_000
+
+# A 1x1 JPEG; the pipeline only needs something Pillow can open
+TINY_JPEG = bytes.fromhex(
+    "ffd8ffe000104a46494600010100000100010000ffdb004300080606070605080707070909080a0c140d0c0b0b0c"
+    "1912130f141d1a1f1e1d1a1c1c20242e2720222c231c1c2837292c30313434341f27393d38323c2e333432ffc000"
+    "0b080001000101011100ffc4001f0000010501010101010100000000000000000102030405060708090a0bffc400"
+    "b5100002010303020403050504040000017d01020300041105122131410613516107227114328191a1082342b1c1"
+    "1552d1f02433627282090a161718191a25262728292a3435363738393a434445464748494a535455565758595a63"
+    "6465666768696a737475767778797a838485868788898a92939495969798999aa2a3a4a5a6a7a8a9aab2b3b4b5b6"
+    "b7b8b9bac2c3c4c5c6c7c8c9cad2d3d4d5d6d7d8d9dae1e2e3e4e5e6e7e8e9eaf1f2f3f4f5f6f7f8f9faffda0008"
+    "010100003f00fbfcffd9"
+)
+TINY_PDF = b"%PDF-1.4\n1 0 obj<<>>endobj\ntrailer<<>>\n%%EOF\n" + b" " * 4000
+
+
+def folder_names(folders):
+    # Deterministic, so a live server seeded by `generate` matches the scenarios
+    return [
+        f"{(START_DATE - timedelta(days=i % 1460)).strftime('%Y%m%d')}_{FOLDER_BASE + i}"
+        for i in range(folders)
+    ]
+
+
+def pick_folder(names, i):
+    # Strided so consecutive requests hit different folders (and directory blocks)
+    return names[(i * 7919) % len(names)]
+
+
+def workorder_doc(rng, folder_name, part_names):
+    day = date(int(folder_name[:4]), int(folder_name[4:6]), int(folder_name[6:8]))
+    return {
+        "technician": rng.choice(TECHNICIANS),
+        "date": day.isoformat(),
+        "week": str(day.isocalendar()[1]),
+        "inTime": f"{rng.randint(6, 10)}:{rng.choice(['00', '15', '30', '45'])} AM",
+        "outTime": f"{rng.randint(1, 6)}:{rng.choice(['00', '15', '30', '45'])} PM",
+        "workOrderNumber": folder_name.split("_")[1],
+        "purchaseOrderNumber": str(rng.randint(10000, 99999)),
+        "customer": rng.choice(CUSTOMERS),
+        "siteAddress": f"{rng.randint(1, 999)} Main St {rng.choice(CITIES)}",
+        "travelLocation": rng.choice(CITIES),
+        "travelHours": str(rng.choice([0.5, 1, 1.5, 2])),
+        "siteContact": rng.choice(["Maria", "Mohammad", "Priya", "John", "Wei"]),
+        "phoneNumber": f"905{rng.randint(1000000, 9999999)}",
+        "jobDescription": " ".join(rng.choices(WORDS, k=rng.randint(5, 20))),
+        "workPerformed": " ".join(rng.choices(WORDS, k=rng.randint(10, 40))),
+        "parts": [
+            {"name": rng.choice(part_names), "unit_price": f"{rng.uniform(1, 200):.2f}", "quantity": str(rng.randint(1, 10))}
+            for _ in range(rng.randint(0, 5))
+        ],
+        "jobStatus": rng.choice(["Job Complete", "Job Incomplete", "Quote Required"]),
+        "orientation": "Yes",
+        "hotWorkPermit": rng.choice(["Yes", "No"]),
+    }
+
+
+def part_name(rng, i):
+    return f"{rng.choice(PART_WORDS)} {rng.choice(PART_WORDS)} {rng.randint(1, 999)}{rng.choice(['A', 'V', 'W', ''])} #{i}"
+
+
+def generate_media(media_root, folders, photos=2, seed=1, flat=False):
+    rng = random.Random(seed)
+    names = [part_name(random.Random(i), i) for i in range(1, 201)]
+    os.makedirs(media_root, exist_ok=True)
+    for folder_name in folder_names(folders):
+        # Same YYYY/MM partitions as media_layout (not imported here: it pulls in the database module)
+        folder_path = os.path.join(media_root, folder_name) if flat else os.path.join(
+            media_root, folder_name[:4], folder_name[4:6], folder_name)
+        os.makedirs(folder_path, exist_ok=True)
+        with open(os.path.join(folder_path, f"{folder_name}.json"), "w") as f:
+            json.dump(workorder_doc(rng, folder_name, names), f, indent=4)
+        with open(os.path.join(folder_path, "workorder.pdf"), "wb") as f:
+            f.write(TINY_PDF)
+        for n in range(photos):
+            with open(os.path.join(folder_path, f"IMG_{n:04d}.jpg"), "wb") as f:
+                f.write(TINY_JPEG)
+
+
+def generate_catalogue(parts_path, travel_path, parts, travel):
+    with open(parts_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["part_id", "part_name", "part_number", "unit_cost", "unit_price", "part_pic"])
+        for i in range(1, parts + 1):
+            rng = random.Random(i)
+            cost = rng.uniform(0.5, 400)
+            writer.writerow([i, part_name(rng, i), f"PN-{i:07d}", f"{cost:.2f}", f"{cost * 1.4:.2f}", ""])
+    with open(travel_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["travel_id", "location", "travel_time_hours"])
+        for i in range(1, travel + 1):
+            writer.writerow([i, f"{CITIES[i % len(CITIES)]} {i}", (i % 8) * 0.5])
+
+
+class RssSampler:
+    """Samples resident set size in a background thread; peak() is the max since reset()."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self._peak = 0
+        self._stop = threading.Event()
+        self._page = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def current(self):
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self._page
+        except OSError:
+            # Not Linux: ru_maxrss is the process peak (KiB on Linux, bytes on macOS)
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return rss if sys.platform == "darwin" else rss * 1024
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def reset(self):
+        self._peak = self.current()
+
+    def peak(self):
+        return max(self._peak, self.current())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._peak = max(self._peak, self.current())
+
+
+class Scenario:
+    def __init__(self, name, build, requests=None, ok=(200,), concurrency=None):
+        self.name = name
+        self.build = build          # i -> (method, url, request kwargs)
+        self.requests = requests    # overrides --requests for expensive routes
+        self.ok = ok
+        self.concurrency = concurrency  # overrides --concurrency for routes an operator runs one at a time
+
+
+def import_csv_bytes(i, rows=100):
+    # Re-prices existing parts (ids 1..rows), so each request updates rather than inserts
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["part_id", "part_name", "part_number", "unit_cost", "unit_price", "part_pic"])
+    for part_id in range(1, rows + 1):
+        rng = random.Random(part_id)
+        cost = rng.uniform(0.5, 400) + i % 7
+        writer.writerow([part_id, part_name(rng, part_id), f"PN-{part_id:07d}", f"{cost:.2f}", f"{cost * 1.4:.2f}", ""])
+    return buffer.getvalue().encode()
+
+
+def scenarios(folders, parts, travel):
+    names = folder_names(folders)
+    queries = ["wire", "breaker 1", "con", "pn-00012", "relay cont", "sw", "box cover", "timer"]
+    fragments = ["eaker", "ntact", "uplin", "allas", "ceptac", "n-0001", "ker bo"]
+    places = ["bra", "tor", "mis", "oak", "ham", "mark", "vau"]
+    # Whole words, multi-word, prefixes, typos and a PO-style number
+    searches = ["magna", "breaker panel", "dock lev", "brampton maria", "ballsat", "troubleshoot motor", "canada post", "fixture 12"]
+    image = ("files", ("bench.jpg", TINY_JPEG, "image/jpeg"))
+    etags = {}
+
+    def pick(i):
+        return pick_folder(names, i)
+
+    def created(i):
+        return f"29991231_{i}"
+
+    def conditional(i):
+        folder = pick(i)
+        headers = {"If-None-Match": etags[folder]} if folder in etags else {}
+        return "GET", f"/workorder/{folder}", {"headers": headers}
+
+    def chunked(i):
+        # Init, two chunks and commit are issued as one scenario step by run_chunked
+        return "CHUNKED", pick(i), {"data": os.urandom(256 * 1024)}
+
+    def abandoned(i):
+        # Init, one chunk, a status poll and the abort, as one step by run_abandoned
+        return "ABANDONED", pick(i), {"data": os.urandom(256 * 1024)}
+
+    return [
+        Scenario("list_workorders_names", lambda i: ("GET", "/workorders", {}), requests=20),
+        Scenario("list_workorders_month", lambda i: (
+            "GET", f"/workorders?month={(START_DATE - timedelta(days=31 * (i % 12))).strftime('%Y-%m')}", {})),
+        Scenario("list_workorders_technician_page", lambda i: (
+            "GET", f"/workorders?technician={TECHNICIANS[i % 2]}&fields=folder_name,date,week,customer,status&limit=100&offset={(i % 5) * 100}", {})),
+        Scenario("list_workorders_full_docs", lambda i: (
+            "GET", f"/workorders?technician={TECHNICIANS[i % 2]}&fields=*&limit=200", {})),
+        Scenario("get_workorder", lambda i: ("GET", f"/workorder/{pick(i)}", {})),
+        Scenario("get_workorder_conditional", conditional, ok=(200, 304)),
+        Scenario("search_workorders", lambda i: ("GET", f"/search-workorders/?query={quote(searches[i % len(searches)])}", {})),
+        Scenario("search_workorders_filtered", lambda i: (
+            "GET", f"/search-workorders/?query={quote(searches[i % len(searches)])}&technician={TECHNICIANS[i % 2]}"
+                   f"&date_from={(START_DATE - timedelta(days=90)).isoformat()}", {})),
+        Scenario("parts_autocomplete", lambda i: ("GET", f"/parts/?part_name={queries[i % len(queries)]}", {})),
+        # Mid-word fragments: no prefix or word-start match, so these hit the trigram tier
+        Scenario("parts_autocomplete_substring", lambda i: ("GET", f"/parts/?part_name={quote(fragments[i % len(fragments)])}", {})),
+        Scenario("travel_autocomplete", lambda i: ("GET", f"/travel-time/?location={places[i % len(places)]}", {})),
+        Scenario("album", lambda i: ("GET", f"/album/{pick(i)}", {})),
+        Scenario("media_file", lambda i: ("GET", f"/media/{pick(i)}/workorder.pdf", {})),
+        Scenario("media_range", lambda i: ("GET", f"/media/{pick(i)}/workorder.pdf", {"headers": {"Range": "bytes=0-1023"}}), ok=(206,)),
+        Scenario("archive_workorder", lambda i: ("GET", f"/workorder/{pick(i)}/archive", {})),
+        Scenario("archive_month", lambda i: (
+            "GET", f"/workorders/archive?month={(START_DATE - timedelta(days=31 * (i % 12))).strftime('%Y-%m')}", {}), requests=10),
+        Scenario("create_workorder", lambda i: ("POST", "/create-workorder/", {
+            "data": {"folder_name": created(i), "json_data": json.dumps(workorder_doc(random.Random(i), created(i), queries))},
+            "files": {"pdf_file": ("workorder.pdf", TINY_PDF, "application/pdf")},
+        })),
+        Scenario("update_workorder", lambda i: ("PUT", "/workorder/", {
+            "data": {"folder_name": created(i)},
+            "files": {"updated_json": ("wo.json", json.dumps(workorder_doc(random.Random(-i), created(i), queries)).encode(), "application/json")},
+        })),
+        Scenario("patch_workorder", lambda i: ("PATCH", f"/workorder/{created(i)}", {
+            "content": json.dumps({"jobStatus": "Complete", "notes": f"bench {i}"}),
+            "headers": {"Content-Type": "application/merge-patch+json", "If-Match": "*"},
+        })),
+        Scenario("upload_images", lambda i: ("POST", "/upload-images/", {"data": {"folder_name": created(i)}, "files": [image]})),
+        Scenario("chunked_upload", chunked),
+        Scenario("workorder_history", lambda i: ("GET", f"/workorder/{created(i)}/history", {})),
+        # History listing plus the oldest kept version, by run_get_version
+        Scenario("workorder_version", lambda i: ("VERSION", created(i), {})),
+        # The same, then a rollback to that version, by run_rollback
+        Scenario("rollback_workorder", lambda i: ("ROLLBACK", created(i), {})),
+        Scenario("upload_status_abort", abandoned),
+        Scenario("delete_workorder", lambda i: ("DELETE", f"/workorder/{created(i)}", {})),
+        Scenario("add_part", lambda i: ("POST", "/parts/", {"data": {
+            "part_name": f"BENCH PART {i}", "part_number": f"B-{i}", "unit_cost": "1.0", "unit_price": "2.0", "part_pic": ""}})),
+        Scenario("update_part", lambda i: ("PUT", f"/parts/{(i % parts) + 1}", {"data": {
+            "part_name": f"UPDATED PART {i}", "part_number": f"U-{i}", "unit_cost": "1.0", "unit_price": "2.5", "part_pic": ""}})),
+        Scenario("delete_part", lambda i: ("DELETE", f"/parts/{parts - i}", {})),
+        Scenario("add_travel", lambda i: ("POST", "/travel/", {"data": {"location": f"Bench Town {i}", "travel_time_hours": "1"}})),
+        Scenario("update_travel", lambda i: ("PUT", f"/travel/{(i % travel) + 1}", {"data": {"location": f"Renamed {i}", "travel_time_hours": "2"}})),
+        Scenario("delete_travel", lambda i: ("DELETE", f"/travel/{travel - i}", {})),
+        Scenario("report_technician_weeks", lambda i: ("GET", f"/reports/technician-weeks?technician={TECHNICIANS[i % 2]}", {})),
+        Scenario("report_customer_months", lambda i: ("GET", f"/reports/customer-months?customer={quote(CUSTOMERS[i % len(CUSTOMERS)])}", {})),
+        Scenario("export_timesheet_csv", lambda i: ("GET", f"/reports/timesheet.csv?technician={TECHNICIANS[i % 2]}", {}), requests=10),
+        Scenario("export_billing_csv", lambda i: ("GET", f"/reports/billing.csv?customer={quote(CUSTOMERS[i % len(CUSTOMERS)])}", {}), requests=10),
+        Scenario("changes_catch_up", lambda i: ("GET", f"/changes?since={(i * 500) % len(names)}&limit=500", {})),
+        Scenario("catalogue_parts_snapshot", lambda i: ("GET", "/catalogue/parts", {"headers": {"Accept-Encoding": "gzip"}}), requests=20),
+        Scenario("db_pool_status", lambda i: ("GET", "/admin/db-pool", {})),
+        Scenario("outbox_status", lambda i: ("GET", "/outbox", {})),
+        Scenario("metrics", lambda i: ("GET", "/metrics", {})),
+        # Admin routes rebuild an index or table wholesale and are run by hand: a few, one at a time
+        Scenario("admin_import_parts", lambda i: ("POST", "/admin/import/parts", {
+            "files": {"csv_file": ("parts.csv", import_csv_bytes(i), "text/csv")}}), requests=10, concurrency=1),
+        Scenario("admin_search_rebuild", lambda i: ("POST", "/admin/search/rebuild", {}), requests=3, concurrency=1),
+        Scenario("admin_rollups_rebuild", lambda i: ("POST", "/admin/rollups/rebuild", {}), requests=3, concurrency=1),
+    ], etags
+
+
+async def run_chunked(client, folder, data):
+    r = await client.post("/uploads/", data={"folder_name": folder, "filename": "bench.mp4", "size": str(len(data))})
+    upload_id = r.json()["upload_id"]
+    half = len(data) // 2
+    await client.put(f"/uploads/{upload_id}?offset=0", content=data[:half])
+    await client.put(f"/uploads/{upload_id}?offset={half}", content=data[half:])
+    return await client.post(f"/uploads/{upload_id}/commit")
+
+
+async def run_abandoned(client, folder, data):
+    r = await client.post("/uploads/", data={"folder_name": folder, "filename": "bench.mp4", "size": str(len(data))})
+    upload_id = r.json()["upload_id"]
+    await client.put(f"/uploads/{upload_id}?offset=0", content=data[:len(data) // 2])
+    await client.get(f"/uploads/{upload_id}")
+    return await client.delete(f"/uploads/{upload_id}")
+
+
+async def run_version(client, folder):
+    r = await client.get(f"/workorder/{folder}/history")
+    versions = r.json().get("versions") if r.status_code == 200 else None
+    if not versions:
+        return r, None
+    return await client.get(f"/workorder/{folder}/history/{versions[-1]['version']}"), versions[-1]["version"]
+
+
+async def run_get_version(client, folder):
+    return (await run_version(client, folder))[0]
+
+
+async def run_rollback(client, folder):
+    # What a client does before restoring: list the history, look at the version, roll back to it
+    r, version = await run_version(client, folder)
+    if version is None or r.status_code != 200:
+        return r
+    return await client.post(f"/workorder/{folder}/rollback/{version}")
+
+
+# Scenario steps that take several requests; the step's response is the last one
+STEPS = {"CHUNKED": run_chunked, "ABANDONED": run_abandoned, "VERSION": run_get_version, "ROLLBACK": run_rollback}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_scenario(client, scenario, requests, concurrency, sampler):
+    latencies, statuses = [], Counter()
+    counter = count()
+    total = scenario.requests or requests
+
+    async def worker():
+        while (i := next(counter)) < total:
+            method, url, kwargs = scenario.build(i)
+            started = time.perf_counter()
+            if method in STEPS:
+                response = await STEPS[method](client, url, **kwargs)
+            else:
+                response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] += 1
+
+    if sampler:
+        sampler.reset()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(scenario.concurrency or concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        "requests": len(latencies),
+        "errors": sum(n for status, n in statuses.items() if status not in scenario.ok),
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "max_ms": ms(latencies[-1] if latencies else None),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "peak_rss_mb": round(sampler.peak() / 2 ** 20, 1) if sampler else None,
+    }
+
+
+async def run_all(args, app=None):
+    import httpx
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    sampler = RssSampler() if app is not None else None
+    if sampler:
+        sampler.start()
+    scenario_list, etags = scenarios(args.folders, args.parts, args.travel)
+    if args.only:
+        wanted = set(args.only.split(","))
+        scenario_list = [s for s in scenario_list if s.name in wanted]
+
+    results = {}
+    if app is not None:
+        transport = httpx.ASGITransport(app=app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120)
+    else:
+        client = httpx.AsyncClient(base_url=args.url, timeout=120, limits=httpx.Limits(max_connections=args.concurrency))
+
+    async with client:
+        # Prime ETags so the conditional scenario measures 304s
+        names = folder_names(args.folders)
+        for folder in {pick_folder(names, i) for i in range(args.requests)}:
+            r = await client.get(f"/workorder/{folder}")
+            if "etag" in r.headers:
+                etags[folder] = r.headers["etag"]
+
+        for scenario in scenario_list:
+            for i in range(args.warmup):
+                method, url, kwargs = scenario.build(10_000_000 + i)
+                if method == "GET":
+                    await client.request(method, url, **kwargs)
+            results[scenario.name] = await run_scenario(client, scenario, args.requests, args.concurrency, sampler)
+            r = results[scenario.name]
+            print(f"{scenario.name:36s} p50={r['p50_ms']:>9}ms p95={r['p95_ms']:>9}ms p99={r['p99_ms']:>9}ms "
+                  f"{r['throughput_rps']:>9} rps errors={r['errors']}", flush=True)
+    if sampler:
+        sampler.stop()
+    return results
+
+
+def compare(results, baseline, max_regression, floor_ms=1.0):
+    """Return human-readable regressions of p95 latency or throughput beyond max_regression."""
+    regressions = []
+    for name, base in baseline.get("results", {}).items():
+        new = results.get(name)
+        if not new or base.get("p95_ms") is None or new.get("p95_ms") is None:
+            continue
+        if new["p95_ms"] > base["p95_ms"] * (1 + max_regression) and new["p95_ms"] - base["p95_ms"] > floor_ms:
+            regressions.append(f"{name}: p95 {base['p95_ms']}ms -> {new['p95_ms']}ms")
+        if base.get("throughput_rps") and new.get("throughput_rps") and \
+                new["throughput_rps"] < base["throughput_rps"] * (1 - max_regression):
+            regressions.append(f"{name}: throughput {base['throughput_rps']} -> {new['throughput_rps']} rps")
+        if new.get("errors", 0) > base.get("errors", 0):
+            regressions.append(f"{name}: errors {base.get('errors', 0)} -> {new['errors']}")
+    return regressions
+
+
+def cmd_generate(args):
+    started = time.perf_counter()
+    generate_media(args.media_root, args.folders, args.photos, args.seed, args.flat)
+    os.makedirs(args.catalogue_dir, exist_ok=True)
+    generate_catalogue(
+        os.path.join(args.catalogue_dir, "parts.csv"), os.path.join(args.catalogue_dir, "travel.csv"),
+        args.parts, args.travel,
+    )
+    print(f"Generated {args.folders} folders and {args.parts} parts in {time.perf_counter() - started:.1f}s")
+
+
+def cmd_run(args):
+    meta = {
+        "folders": args.folders, "parts": args.parts, "travel": args.travel, "photos": args.photos,
+        "requests": args.requests, "concurrency": args.concurrency, "seed": args.seed,
+        "python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "target": args.url or "in-process",
+    }
+
+    if args.url:
+        results = asyncio.run(run_all(args))
+    else:
+        workdir = args.workdir or tempfile.mkdtemp(prefix="workorder-bench-")
+        media_root = os.path.join(workdir, "media")
+        started = time.perf_counter()
+        if not os.path.isdir(media_root):
+            generate_media(media_root, args.folders, args.photos, args.seed, args.flat)
+        generate_catalogue(os.path.join(workdir, "parts.csv"), os.path.join(workdir, "travel.csv"), args.parts, args.travel)
+        meta["generate_seconds"] = round(time.perf_counter() - started, 2)
+
+        # Configure before main/database are imported; never send real email from a benchmark
+        os.environ["MEDIA_ROOT"] = media_root
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+        os.environ["OUTBOX_COALESCE_SECONDS"] = str(10 ** 9)
+        os.chdir(workdir)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+        from database import Base, engine
+        import importer
+        Base.metadata.create_all(bind=engine)
+        started = time.perf_counter()
+        for kind, name in (("parts", "parts.csv"), ("travel", "travel.csv")):
+            with open(os.path.join(workdir, name), newline="") as f:
+                importer.import_csv(kind, f)
+        meta["import_seconds"] = round(time.perf_counter() - started, 2)
+
+        import main
+
+        async def in_process():
+            started = time.perf_counter()
+            async with main.app.router.lifespan_context(main.app):
+                meta["startup_seconds"] = round(time.perf_counter() - started, 2)
+                return await run_all(args, main.app)
+
+        results = asyncio.run(in_process())
+        meta["workdir"] = workdir
+
+    output = {"meta": meta, "results": results}
+    out_path = args.out or os.path.join("bench_results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    out_path = os.path.abspath(os.path.join(args.cwd, out_path))
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with open(out_path, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Results written to {out_path}")
+
+    if args.baseline:
+        with open(os.path.join(args.cwd, args.baseline)) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+    return 1 if any(r["errors"] for r in results.values()) else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def data_args(p):
+        p.add_argument("--folders", type=int, default=1000, help="work-order folders to generate (1k-100k)")
+        p.add_argument("--photos", type=int, default=2, help="photos per folder")
+        p.add_argument("--parts", type=int, default=100_000)
+        p.add_argument("--travel", type=int, default=2_000)
+        p.add_argument("--seed", type=int, default=1)
+        p.add_argument("--flat", action="store_true", help="old flat media layout, e.g. to time media_layout.py migrate")
+
+    gen = sub.add_parser("generate", help="only build the synthetic media tree and CSV catalogue")
+    data_args(gen)
+    gen.add_argument("--media-root", default="bench_media")
+    gen.add_argument("--catalogue-dir", default="bench_catalogue")
+
+    run = sub.add_parser("run", help="generate data (unless --url) and benchmark every endpoint")
+    data_args(run)
+    run.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    run.add_argument("--concurrency", type=int, default=8)
+    run.add_argument("--warmup", type=int, default=5)
+    run.add_argument("--only", help="comma-separated scenario names")
+    run.add_argument("--url", help="benchmark a live server seeded with `generate` instead of in-process")
+    run.add_argument("--workdir", help="reuse a work directory (its media/ tree is kept between runs)")
+    run.add_argument("--out", help="result JSON path (default bench_results/<timestamp>.json)")
+    run.add_argument("--baseline", help="earlier result JSON to compare against")
+    run.add_argument("--max-regression", type=float, default=0.25, help="allowed fractional p95/throughput regression")
+
+    args = parser.parse_args(argv)
+    args.cwd = os.getcwd()
+    if args.command == "generate":
+        cmd_generate(args)
+        return 0
+    return cmd_run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,28 +1,14 @@
-import csv
-from sqlalchemy.orm import Session
-from database import SessionLocal
-from models import Part
+from importer import import_csv
 
-def bulk_insert_parts(csv_path):
-    db: Session = SessionLocal()
-    with open(csv_path, newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            try:
-                part = Part(
-                    part_id=int(row["part_id"]),
-                    part_name=row["part_name"],
-                    part_number=row["part_number"] or None,
-                    unit_cost=float(row["unit_cost"]) if row["unit_cost"] else None,
-                    unit_price=float(row["unit_price"]) if row["unit_price"] else None,
-                    part_pic=row["part_pic"] or None
-                )
-                db.add(part)
-            except Exception as e:
-                print(f"❌ Error on row {row['part_id']}: {e}")
-        db.commit()
-        db.close()
-        print("✅ Parts imported successfully.")
+def bulk_insert_parts(csv_path, delete_missing=False):
+    # Upserts on part_id through the staging-table importer; safe to re-run with a newer price list
+    with open(csv_path, newline='', encoding='utf-8-sig') as csvfile:
+        report = import_csv("parts", csvfile, delete_missing=delete_missing)
+    for error in report["errors"]:
+        print(f"❌ Error on row {error['row']}: {error['error']}")
+    print(f"✅ Parts imported: {report['inserted']} inserted, {report['updated']} updated, "
+          f"{report['unchanged']} unchanged, {report['rejected']} rejected.")
+    return report
 
 if __name__ == "__main__":
     bulk_insert_parts("parts_data.csv")
@@ -1,24 +1,12 @@
-import csv
-from sqlalchemy.orm import Session
-from database import SessionLocal
-from models import Travel
+from importer import import_csv
 
-def bulk_insert_from_csv(csv_path):
-    db: Session = SessionLocal()
-    with open(csv_path, newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            try:
-                travel = Travel(
-                    id=int(row["travel_id"]),
-                    location=row["location"],
-                    travel_time_hours=float(row["travel_time_hours"])
-                )
-                db.add(travel)
-            except Exception as e:
-                print(f"Error with row {row}: {e}")
-        db.commit()
-    db.close()
+def bulk_insert_from_csv(csv_path, delete_missing=False):
+    # Upserts on location through the staging-table importer; safe to re-run
+    with open(csv_path, newline='', encoding='utf-8-sig') as csvfile:
+        report = import_csv("travel", csvfile, delete_missing=delete_missing)
+    for error in report["errors"]:
+        print(f"Error with row {error['row']}: {error['error']}")
+    return report
 
 if __name__ == "__main__":
     bulk_insert_from_csv("travel_data.csv")
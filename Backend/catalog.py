@@ -0,0 +1,175 @@
+import os, json, logging
+from datetime import date, datetime
+from sqlalchemy.orm import Session, load_only
+from models import WorkOrder
+import metrics
+import rollups
+import media_layout
+import changes
+import search
+
+logger = logging.getLogger(__name__)
+
+# Columns that can be served straight from the catalog without loading the document
+CATALOG_FIELDS = ("folder_name", "technician", "date", "week", "customer", "status", "mtime")
+
+
+def _parse_date(data, folder_name):
+    value = data.get("date")
+    if value:
+        try:
+            return date.fromisoformat(str(value)[:10])
+        except ValueError:
+            pass
+    # Folders are named YYYYMMDD_<number>
+    try:
+        return datetime.strptime(folder_name[:8], "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+def _parse_week(data):
+    value = data.get("week") or data.get("weekNumber")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def record_workorder(db: Session, folder_name, json_path, data=None, rollup=True):
+    """Insert or refresh the catalog row for one work order (caller commits).
+
+    With rollup=False the caller is batching rollups.apply_workorders and the change log itself.
+    """
+    mtime = os.stat(json_path).st_mtime
+    if data is None:
+        with open(json_path, "rb") as f:
+            body = f.read()
+        metrics.fs_read(len(body))
+        data = json.loads(body)
+
+    row = db.get(WorkOrder, folder_name) or WorkOrder(folder_name=folder_name)
+    row.technician = data.get("technician")
+    row.date = _parse_date(data, folder_name)
+    row.week = _parse_week(data)
+    row.customer = data.get("customer")
+    row.status = data.get("jobStatus") or data.get("job_status")
+    row.mtime = mtime
+    row.data = data
+    db.add(row)
+    search.index.add(folder_name, data, mtime, row.date, row.technician, row.status)
+    if rollup:
+        rollups.apply_workorder(db, row)
+        changes.record(db, "workorder", folder_name)
+    return row
+
+
+def remove_workorder(db: Session, folder_name):
+    rollups.remove_workorder(db, folder_name)
+    search.index.remove(folder_name)
+    db.query(WorkOrder).filter(WorkOrder.folder_name == folder_name).delete()
+    changes.record(db, "workorder", folder_name, "delete")
+
+
+def sync_catalog(db: Session, media_root):
+    """Reconcile the catalog with the media tree, reloading only JSON files whose mtime changed."""
+    known = dict(db.query(WorkOrder.folder_name, WorkOrder.mtime).all())
+    seen = set()
+    changed = []
+
+    # One pass over the search postings at the end instead of one per work order
+    with search.index.bulk():
+        for folder_name, path in media_layout.iter_folders(media_root):
+            if folder_name in seen:
+                continue
+            json_path = os.path.join(path, f"{folder_name}.json")
+            try:
+                mtime = os.stat(json_path).st_mtime
+            except FileNotFoundError:
+                continue
+            seen.add(folder_name)
+            if known.get(folder_name) == mtime:
+                continue
+            try:
+                changed.append(record_workorder(db, folder_name, json_path, rollup=False))
+            except (OSError, ValueError) as e:
+                logger.warning("Skipping %s in catalog sync: %s", folder_name, e)
+                seen.discard(folder_name)
+
+    stale = set(known) - seen
+    if stale:
+        rollups.remove_workorders(db, stale)
+        for folder_name in stale:
+            search.index.remove(folder_name)
+        db.query(WorkOrder).filter(WorkOrder.folder_name.in_(stale)).delete(synchronize_session=False)
+    for start in range(0, len(changed), 500):
+        rollups.apply_workorders(db, changed[start:start + 500])
+    # Logged last: the change-log lock is held from here to the commit
+    changes.record(db, "workorder", sorted(stale), "delete")
+    changes.record(db, "workorder", [row.folder_name for row in changed])
+    db.commit()
+
+
+def query_workorders(db: Session, technician=None, date_from=None, date_to=None,
+                     week_from=None, week_to=None, fields=None, limit=100, offset=0):
+    query = db.query(WorkOrder)
+    if technician:
+        query = query.filter(WorkOrder.technician == technician)
+    if date_from:
+        query = query.filter(WorkOrder.date >= date_from)
+    if date_to:
+        query = query.filter(WorkOrder.date <= date_to)
+    if week_from is not None:
+        query = query.filter(WorkOrder.week >= week_from)
+    if week_to is not None:
+        query = query.filter(WorkOrder.week <= week_to)
+
+    total = query.count()
+
+    # Only pull the stored document when a field outside the catalog columns is requested
+    wanted = fields or list(CATALOG_FIELDS)
+    needs_document = "*" in wanted or any(name not in CATALOG_FIELDS for name in wanted)
+    if not needs_document:
+        query = query.options(load_only(*(getattr(WorkOrder, name) for name in CATALOG_FIELDS)))
+
+    rows = (
+        query.order_by(WorkOrder.date.desc(), WorkOrder.folder_name.desc())
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+    return total, [_project(row, wanted) for row in rows]
+
+
+def documents(db: Session, folder_names):
+    """folder name -> stored JSON document, for the given folders."""
+    rows = db.query(WorkOrder.folder_name, WorkOrder.data).filter(WorkOrder.folder_name.in_(list(folder_names)))
+    return {name: data or {} for name, data in rows}
+
+
+def folder_names(db: Session, technician=None, date_from=None, date_to=None):
+    """Catalogued folder names matching the filters, oldest first."""
+    query = db.query(WorkOrder.folder_name)
+    if technician:
+        query = query.filter(WorkOrder.technician == technician)
+    if date_from:
+        query = query.filter(WorkOrder.date >= date_from)
+    if date_to:
+        query = query.filter(WorkOrder.date <= date_to)
+    return [name for name, in query.order_by(WorkOrder.date, WorkOrder.folder_name)]
+
+
+def _project(row, fields):
+    if "*" in fields:
+        item = dict(row.data or {})
+        item["folder_name"] = row.folder_name
+        return item
+
+    item = {}
+    for name in fields:
+        if name in CATALOG_FIELDS:
+            item[name] = getattr(row, name)
+        else:
+            item[name] = (row.data or {}).get(name)
+    item.setdefault("folder_name", row.folder_name)
+    return item
@@ -0,0 +1,166 @@
+import os, json, time, hashlib, threading
+from sqlalchemy import select, insert, delete, func, text
+from models import Change, WorkOrder, Part, Travel
+from autocomplete import part_record, travel_record
+
+CHANGES_RETENTION_DAYS = float(os.getenv("CHANGES_RETENTION_DAYS", "90"))
+# Transaction-level advisory lock serialising change-log writers on PostgreSQL
+_LOG_LOCK_KEY = 0x63686E67
+
+# Snapshot kind -> (entity in the log, columns sent, primary key)
+CATALOGUES = {
+    "parts": ("part", (Part.part_id, Part.part_name, Part.part_number, Part.unit_cost, Part.unit_price, Part.part_pic), Part.part_id),
+    "travel": ("travel", (Travel.id, Travel.location, Travel.travel_time_hours), Travel.id),
+}
+
+
+def record(db, entity, keys, op="upsert"):
+    """Append changes for one or more keys (caller commits, so the entry lands with the change).
+
+    db can be a Session or a Connection; the importer logs from inside its own transaction.
+    """
+    if isinstance(keys, (str, int)):
+        keys = [keys]
+    now = time.time()
+    rows = [{"entity": entity, "key": str(key), "op": op, "created_at": now} for key in keys]
+    if rows:
+        _lock_log(db)
+        db.execute(insert(Change), rows)
+
+
+def _lock_log(db):
+    """Hold the change log until this transaction ends, so ids become visible in id order.
+
+    Otherwise a transaction could take id 5, commit after another one took 6, and a client that
+    had already synced to 6 would never see 5. With writers serialised, the highest committed id
+    is always a safe cursor. SQLite already allows one writer at a time; PostgreSQL needs the
+    advisory lock, which is released at commit or rollback.
+    """
+    if hasattr(db, "dialect"):
+        dialect = db.dialect
+    else:
+        # Row locks first: holding this lock while waiting on a row could deadlock with its owner
+        db.flush()
+        dialect = db.get_bind().dialect
+    if dialect.name == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _LOG_LOCK_KEY})
+
+
+def reload(db, entity):
+    # Bulk edits (CSV imports) log one entry; clients re-download that catalogue's snapshot
+    record(db, entity, "*", "reload")
+
+
+def prune(db, retention_days=CHANGES_RETENTION_DAYS):
+    """Drop entries older than the retention window, always keeping the newest one (caller commits).
+
+    Clients whose cursor falls behind what is left get reset=true and resync from snapshots.
+    """
+    newest = db.scalar(select(func.max(Change.id)))
+    if newest is None:
+        return 0
+    cutoff = time.time() - retention_days * 86400
+    return db.execute(delete(Change).where(Change.created_at < cutoff, Change.id < newest)).rowcount
+
+
+def _settled_cursor(db):
+    # Every id up to the highest committed one is committed too (see _lock_log)
+    return db.scalar(select(func.max(Change.id))) or 0
+
+
+def _payloads(db, entity, keys):
+    if entity == "workorder":
+        return dict(db.execute(select(WorkOrder.folder_name, WorkOrder.data).where(WorkOrder.folder_name.in_(keys))).all())
+    ids = [int(key) for key in keys if key.isdigit()]
+    if entity == "part":
+        return {str(part.part_id): part_record(part) for part in db.scalars(select(Part).where(Part.part_id.in_(ids)))}
+    return {str(travel.id): {"id": travel.id, **travel_record(travel)} for travel in db.scalars(select(Travel).where(Travel.id.in_(ids)))}
+
+
+def feed(db, since=0, limit=500):
+    """Changes after cursor `since`, collapsed to the latest state of each record.
+
+    Upserts carry the current record (the work-order document, or the part / travel row);
+    one that has since been deleted comes back as a delete. A "reload" entry means a bulk
+    import replaced that catalogue: fetch its snapshot again.
+    """
+    oldest = db.scalar(select(func.min(Change.id)))
+    settled = _settled_cursor(db)
+    if (oldest is not None and since < oldest - 1) or since > settled:
+        # The cursor predates what the log still holds (or comes from another database)
+        return {"reset": True, "cursor": settled, "has_more": False, "changes": []}
+
+    entries = db.execute(
+        select(Change.id, Change.entity, Change.key, Change.op)
+        .where(Change.id > since, Change.id <= settled)
+        .order_by(Change.id)
+        .limit(limit + 1)
+    ).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    # Several edits to one record in this page only need sending once, in their last position
+    latest = {}
+    for entry in entries:
+        latest.pop((entry.entity, entry.key), None)
+        latest[(entry.entity, entry.key)] = entry
+
+    wanted = {}
+    for (entity, key), entry in latest.items():
+        if entry.op == "upsert":
+            wanted.setdefault(entity, []).append(key)
+    payloads = {entity: _payloads(db, entity, keys) for entity, keys in wanted.items()}
+
+    changes = []
+    for (entity, key), entry in latest.items():
+        change = {"id": entry.id, "entity": entity, "key": key if entity == "workorder" or key == "*" else int(key), "op": entry.op}
+        if entry.op == "upsert":
+            data = payloads[entity].get(key)
+            if data is None:
+                change["op"] = "delete"
+            else:
+                change["data"] = data
+        changes.append(change)
+
+    return {
+        "reset": False,
+        "cursor": entries[-1].id if entries else since,
+        "has_more": has_more,
+        "changes": changes,
+    }
+
+
+class _SnapshotCache:
+    """Serialized catalogue snapshots, rebuilt only when that catalogue's version moves on."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # kind -> (version, cursor, body, etag, encoded bodies)
+
+    def get(self, db, kind):
+        entity, columns, key = CATALOGUES[kind]
+        # Read the version before the rows: a change racing the read is replayed from /changes
+        version = db.scalar(select(func.max(Change.id)).where(Change.entity == entity)) or 0
+        oldest = db.scalar(select(func.min(Change.id))) or 1
+        with self._lock:
+            cached = self._entries.get(kind)
+        # Also rebuilt once pruning overtakes its cursor, or /changes would keep answering reset
+        if cached and cached[0] == version and cached[1] >= oldest - 1:
+            return cached
+
+        cursor = _settled_cursor(db)
+        rows = [list(row) for row in db.execute(select(*columns).order_by(key))]
+        body = json.dumps({
+            "kind": kind,
+            "version": version,
+            "cursor": cursor,
+            "columns": [column.key for column in columns],
+            "rows": rows,
+        }, separators=(",", ":")).encode()
+        cached = (version, cursor, body, f'"{hashlib.sha1(body).hexdigest()}"', {})
+        with self._lock:
+            self._entries[kind] = cached
+        return cached
+
+
+snapshots = _SnapshotCache()
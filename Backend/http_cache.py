@@ -0,0 +1,284 @@
+import os, json, gzip, hashlib, threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse
+from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+import metrics
+from media_layout import partition
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+MEDIA_MAX_AGE = int(os.getenv("MEDIA_MAX_AGE", str(7 * 24 * 3600)))
+JSON_CACHE_ENTRIES = int(os.getenv("JSON_CACHE_ENTRIES", "512"))
+
+# Suffixes the compression middleware appends to ETags of encoded representations
+_ENCODING_SUFFIXES = ("-br", "-gzip")
+
+
+def negotiate_encoding(accept):
+    """Pick br or gzip from an Accept-Encoding header by q-value; None means send it as is.
+
+    Tokens are matched whole ("br", not any name containing it), q=0 refuses an encoding, "*"
+    stands for any encoding not listed, and br wins a tie since it compresses better.
+    """
+    weights = {}
+    for item in accept.lower().split(","):
+        name, _, params = item.partition(";")
+        name = name.strip()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+    wildcard = weights.get("*", 0.0)
+    offered = ("br", "gzip") if brotli is not None else ("gzip",)
+    best = max(offered, key=lambda name: weights.get(name, wildcard))
+    return best if weights.get(best, wildcard) > 0 else None
+
+
+def etag_matches(header, etag):
+    """If-None-Match / If-Match comparison; ignores the -br/-gzip suffixes added on compression."""
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip().removeprefix("W/")
+        for suffix in _ENCODING_SUFFIXES:
+            if candidate.endswith(f'{suffix}"'):
+                candidate = candidate[:-len(suffix) - 1] + '"'
+        if candidate == etag:
+            return True
+    return False
+
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def conditional_response(request: Request, body: bytes, etag, last_modified=None, media_type="application/json"):
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    if _not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+def conditional_stream(request: Request, chunks, etag, last_modified, media_type, headers=None):
+    """StreamingResponse with the same ETag / Last-Modified revalidation as the media files.
+
+    chunks should be a generator: it isn't started when the answer is 304.
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache", **(headers or {})}
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    if _not_modified(request, etag, last_modified):
+        chunks.close()
+        return Response(status_code=304, headers=headers)
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+
+def encoded_response(request: Request, body: bytes, etag, encoded, media_type="application/json"):
+    """conditional_response for large bodies served many times: each encoding is compressed
+    once and kept in `encoded` (encoding -> bytes), instead of per request by the middleware."""
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+    if encoding is None:
+        response = conditional_response(request, body, etag, media_type=media_type)
+        # Another client gets this URL compressed, so shared caches must key on the header
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    headers = {"ETag": f'{etag[:-1]}-{encoding}"', "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if _not_modified(request, etag, None):
+        return Response(status_code=304, headers=headers)
+    if encoding not in encoded:
+        encoded[encoding] = CompressionMiddleware._compress(body, encoding)
+    headers["Content-Encoding"] = encoding
+    return Response(content=encoded[encoding], media_type=media_type, headers=headers)
+
+
+def json_response(request: Request, content, last_modified=None):
+    """Serialize content once and answer with a strong ETag, or 304 when the client already has it."""
+    # jsonable_encoder only for what json can't handle itself (dates, ORM rows); walking
+    # every value of a large plain document through it costs more than the dump
+    body = json.dumps(content, separators=(",", ":"), default=jsonable_encoder).encode()
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    return conditional_response(request, body, etag, last_modified)
+
+
+class _JsonFileCache:
+    """Bytes and ETag of recently served JSON files, keyed by path and invalidated by stat."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, stat):
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached and cached[0] == key:
+                self._entries.move_to_end(path)
+                return cached[1], cached[2]
+
+        with open(path, "rb") as f:
+            body = f.read()
+        metrics.fs_read(len(body))
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        with self._lock:
+            self._entries[path] = (key, etag, body)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return etag, body
+
+    def discard(self, path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+
+json_files = _JsonFileCache(JSON_CACHE_ENTRIES)
+
+
+def json_file_response(request: Request, path):
+    """Serve a JSON file as stored on disk, without parsing or re-serialising it."""
+    stat = os.stat(path)
+    etag, body = json_files.get(path, stat)
+    return conditional_response(request, body, etag, stat.st_mtime)
+
+
+def _range_length(range_header, size):
+    # Bytes FileResponse will actually read for a single "bytes=a-b" range; anything else is the whole file
+    if not range_header or "," in range_header or not range_header.startswith("bytes="):
+        return size
+    start, _, end = range_header[6:].partition("-")
+    try:
+        if not start:
+            return min(int(end), size)
+        end = min(int(end), size - 1) if end else size - 1
+        return max(0, end - int(start) + 1)
+    except ValueError:
+        return size
+
+
+class MediaFiles(StaticFiles):
+    """StaticFiles with a cache policy: derivatives are immutable, originals revalidate by ETag.
+
+    Starlette already answers Range requests and If-None-Match / If-Modified-Since here.
+    Old /media/<folder>/... URLs from before the YYYY/MM layout resolve to the partition.
+    """
+
+    def lookup_path(self, path):
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is None:
+            folder_name, _, rest = path.replace("\\", "/").partition("/")
+            part = partition(folder_name)
+            if part:
+                return super().lookup_path(f"{part}/{folder_name}/{rest}")
+        return full_path, stat_result
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if response.status_code == 200:
+            metrics.fs_read(_range_length(Headers(scope=scope).get("range"), stat_result.st_size))
+        if "/.derivatives/" in str(full_path):
+            # Derivative names are content hashes, so they can never change
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["Cache-Control"] = f"public, max-age={MEDIA_MAX_AGE}"
+        return response
+
+
+class CompressionMiddleware:
+    """Brotli/gzip for single-body text and JSON responses above minimum_size.
+
+    Streaming responses (more_body) and already-encoded bodies pass through untouched.
+    """
+
+    COMPRESSIBLE = ("application/json", "text/")
+
+    def __init__(self, app, minimum_size=1024, offload_size=256 * 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.offload_size = offload_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+
+            response_start, start = start, None
+            headers = MutableHeaders(raw=response_start["headers"])
+            body = message.get("body", b"")
+            if (
+                message.get("more_body")
+                or response_start["status"] != 200
+                or "content-encoding" in headers
+                or not headers.get("content-type", "").startswith(self.COMPRESSIBLE)
+            ):
+                await send(response_start)
+                await send(message)
+                return
+
+            # Whether this body goes out compressed depends on the request's Accept-Encoding,
+            # so even an identity answer must say so or a shared cache could serve it to anyone
+            if "accept-encoding" not in headers.get("vary", "").lower():
+                headers.add_vary_header("Accept-Encoding")
+            if encoding is None or len(body) < self.minimum_size:
+                await send(response_start)
+                await send(message)
+                return
+
+            if len(body) >= self.offload_size:
+                body = await run_in_threadpool(self._compress, body, encoding)
+            else:
+                body = self._compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            etag = headers.get("etag")
+            if etag and etag.endswith('"'):
+                headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+            await send(response_start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def _compress(body, encoding):
+        if encoding == "br":
+            return brotli.compress(body, quality=5)
+        return gzip.compress(body, compresslevel=6)
@@ -0,0 +1,239 @@
+import io, csv, sys, json, time, argparse
+from itertools import islice
+from sqlalchemy import (
+    Table, Column, MetaData, Integer, Float, Text, Index,
+    select, insert, update, delete, exists, func, or_, text,
+)
+from database import engine
+from models import Part, Travel
+import changes
+
+BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 100
+
+
+def _text(value):
+    value = (value or "").strip()
+    return value or None
+
+
+def _int(value):
+    value = _text(value)
+    return int(value) if value is not None else None
+
+
+def _float(value):
+    value = _text(value)
+    return float(value) if value is not None else None
+
+
+# kind -> target table, natural key, and (column, parser, required) in CSV order.
+# Travel rows take their id from the database sequence; the key is the location.
+SPECS = {
+    "parts": {
+        "table": Part.__table__,
+        "key": "part_id",
+        "entity": "part",
+        "reset_sequence": True,
+        "columns": [
+            ("part_id", _int, True),
+            ("part_name", _text, True),
+            ("part_number", _text, False),
+            ("unit_cost", _float, False),
+            ("unit_price", _float, False),
+            ("part_pic", _text, False),
+        ],
+    },
+    "travel": {
+        "table": Travel.__table__,
+        "key": "location",
+        "entity": "travel",
+        "columns": [
+            ("location", _text, True),
+            ("travel_time_hours", _float, True),
+        ],
+    },
+}
+
+_SQL_TYPES = {_int: Integer, _float: Float, _text: Text}
+
+
+class _CsvStream(io.RawIOBase):
+    """Read-only file object that renders staged rows as CSV on demand, for COPY FROM STDIN."""
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._pending = b""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._pending) < size:
+            chunk = next(self._rows, None)
+            if chunk is None:
+                break
+            self._writer.writerow(chunk)
+            if self._buffer.tell() >= 64 * 1024:
+                self._flush()
+        self._flush()
+        if size < 0:
+            data, self._pending = self._pending, b""
+        else:
+            data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def _flush(self):
+        self._pending += self._buffer.getvalue().encode()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+
+
+def _parse(reader, header, columns, report):
+    """Yield (row_no, *values) for valid rows; record rejects in the report."""
+    fields = [(header.index(name) if name in header else None, name, parse, required)
+              for name, parse, required in columns]
+    for row_no, row in enumerate(reader, start=2):  # row 1 is the header
+        try:
+            values = [row_no]
+            for index, name, parse, required in fields:
+                value = parse(row[index]) if index is not None and index < len(row) else None
+                if required and value is None:
+                    raise ValueError(f"missing {name}")
+                values.append(value)
+        except ValueError as e:
+            report["rejected"] += 1
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append({"row": row_no, "error": str(e)})
+            continue
+        report["rows"] += 1
+        yield values
+
+
+def _load_stage(conn, stage, rows):
+    if conn.dialect.name == "postgresql":
+        names = ", ".join(c.name for c in stage.columns)
+        cursor = conn.connection.cursor()
+        cursor.copy_expert(f"COPY {stage.name} ({names}) FROM STDIN WITH (FORMAT csv)", _CsvStream(rows))
+        return
+
+    # Plain DBAPI executemany with tuples; the ORM/Core row processing is the slow part here
+    placeholders = ", ".join("?" if conn.dialect.paramstyle == "qmark" else "%s" for _ in stage.columns)
+    sql = f"INSERT INTO {stage.name} VALUES ({placeholders})"
+    cursor = conn.connection.cursor()
+    while batch := list(islice(rows, BATCH_SIZE)):
+        cursor.executemany(sql, batch)
+
+
+def import_csv(kind, source, delete_missing=False, dry_run=False, bind=engine):
+    """Upsert a CSV catalogue on its natural key through a staging table.
+
+    Returns counts of inserted / updated / unchanged / rejected / deleted rows, with the
+    row numbers of the first rejects. Nothing is written when dry_run is set.
+    """
+    spec = SPECS[kind]
+    target, key = spec["table"], spec["key"]
+    columns = spec["columns"]
+    names = [name for name, _, _ in columns]
+
+    reader = csv.reader(source)
+    header = [name.strip() for name in next(reader, [])]
+    missing = [name for name, _, required in columns if required and name not in header]
+    if missing:
+        raise ValueError(f"CSV is missing required columns: {', '.join(missing)}")
+
+    report = {
+        "kind": kind, "rows": 0, "inserted": 0, "updated": 0, "unchanged": 0,
+        "rejected": 0, "deleted": 0, "errors": [], "dry_run": dry_run,
+    }
+    started = time.perf_counter()
+
+    stage = Table(
+        f"import_{kind}", MetaData(),
+        Column("row_no", Integer, nullable=False),
+        *(Column(name, _SQL_TYPES[parse]) for name, parse, _ in columns),
+        prefixes=["TEMPORARY"],
+    )
+    Index(f"ix_import_{kind}_key", stage.c[key])
+
+    with bind.begin() as conn:
+        # The staging table is created inside the transaction, so a failed import rolls it back
+        stage.drop(conn, checkfirst=True)
+        stage.create(conn)
+        _load_stage(conn, stage, _parse(reader, header, columns, report))
+
+        # Duplicate keys within the file: the first occurrence wins
+        earlier = stage.alias("earlier")
+        dup_filter = exists().where(earlier.c[key] == stage.c[key]).where(earlier.c.row_no < stage.c.row_no)
+        duplicates = conn.execute(
+            select(stage.c.row_no, stage.c[key]).where(dup_filter).order_by(stage.c.row_no)
+        ).all()
+        if duplicates:
+            conn.execute(delete(stage).where(dup_filter))
+            report["rows"] -= len(duplicates)
+            report["rejected"] += len(duplicates)
+            for row_no, value in duplicates[:MAX_REPORTED_ERRORS - len(report["errors"])]:
+                report["errors"].append({"row": row_no, "error": f"duplicate {key} {value!r}"})
+            report["errors"].sort(key=lambda e: e["row"])
+
+        matches = target.c[key] == stage.c[key]
+        changed = or_(*(target.c[name].is_distinct_from(stage.c[name]) for name in names if name != key))
+        report["inserted"] = conn.execute(
+            select(func.count()).select_from(stage).where(~exists().where(matches))
+        ).scalar()
+        report["updated"] = conn.execute(
+            select(func.count()).select_from(stage.join(target, matches)).where(changed)
+        ).scalar()
+        report["unchanged"] = report["rows"] - report["inserted"] - report["updated"]
+
+        if delete_missing:
+            gone = ~exists().where(stage.c[key] == target.c[key])
+            report["deleted"] = conn.execute(
+                select(func.count()).select_from(target).where(gone)
+            ).scalar()
+
+        if not dry_run:
+            conn.execute(
+                update(target).where(matches).where(changed)
+                .values({name: stage.c[name] for name in names if name != key})
+            )
+            conn.execute(
+                insert(target).from_select(
+                    names, select(*(stage.c[name] for name in names)).where(~exists().where(matches))
+                )
+            )
+            if delete_missing:
+                conn.execute(delete(target).where(gone))
+            if report["inserted"] or report["updated"] or report["deleted"]:
+                # One entry for the whole file; offline clients re-download the snapshot
+                changes.reload(conn, spec["entity"])
+            if conn.dialect.name == "postgresql" and spec.get("reset_sequence"):
+                # Explicit ids don't advance the serial; keep later POSTs from colliding
+                conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{target.name}', '{key}'), "
+                    f"COALESCE(MAX({key}), 1)) FROM {target.name}"
+                ))
+        stage.drop(conn)
+
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import a parts or travel CSV catalogue.")
+    parser.add_argument("kind", choices=sorted(SPECS))
+    parser.add_argument("csv_path")
+    parser.add_argument("--delete-missing", action="store_true", help="delete rows that are not in the file")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args(argv)
+
+    with open(args.csv_path, newline="", encoding="utf-8-sig") as f:
+        report = import_csv(args.kind, f, args.delete_missing, args.dry_run)
+    print(json.dumps(report, indent=2))
+    return 1 if report["rejected"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,5 @@
 from database import engine
-from models import Base, Travel, Part  # 👈 Add Part here
+from models import Base, Travel, Part, WorkOrder, OutboxEmail, WorkOrderContribution, TechnicianWeekRollup, CustomerMonthRollup, Change  # 👈 Add Part here
 
 # Create all tables
 Base.metadata.create_all(bind=engine)
@@ -1,84 +1,103 @@
-from fastapi import FastAPI, UploadFile, File, Form, Depends, APIRouter, HTTPException
-from fastapi.responses import JSONResponse, HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from datetime import datetime
-import os, shutil, json
-from email.message import EmailMessage
-import smtplib
+from fastapi import FastAPI, UploadFile, File, Form, Body, Depends, APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+import anyio.to_thread
+from datetime import datetime, date
+import os, io, json, html, logging, calendar
+from urllib.parse import quote
 from dotenv import load_dotenv
 from sqlalchemy.orm import Session
-from database import get_db
-from models import Travel, Part
+from sqlalchemy.schema import CreateIndex
+from database import get_db, get_read_db, pool_stats, engine, SessionLocal, Base
+from models import Travel, Part, part_name_lookup
+import archive
+import catalog
+import media_layout
+import rollups
+import changes
+import search
+from outbox import outbox
+import uploads
+import workorder_store
+import importer
+import metrics
+from metrics import MetricsMiddleware
+from http_cache import MediaFiles, CompressionMiddleware, json_response, json_file_response, encoded_response, conditional_stream
+from thumbnails import derivatives, DERIVATIVES_DIRNAME, IMAGE_EXTENSIONS, VIDEO_EXTENSIONS
+from autocomplete import parts_index, travel_index, index_part, index_travel, load_indexes
 
 
 router = APIRouter()
 
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", "media")
+
 # Load environment variables from .env
 load_dotenv()
 
-EMAIL_USER = os.getenv("EMAIL_USER")
-EMAIL_PASS = os.getenv("EMAIL_PASS")
-EMAIL_TO = os.getenv("EMAIL_TO")
-
-def send_email(subject, body):
-    msg = EmailMessage()
-    msg["From"] = EMAIL_USER
-    msg["To"] = EMAIL_TO
-    msg["Subject"] = subject
-    msg.set_content(body)
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://127.0.0.1:8000")
 
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-        smtp.login(EMAIL_USER, EMAIL_PASS)
-        smtp.send_message(msg)
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+logger = logging.getLogger("workorder")
 
 @router.post("/create-workorder/")
 async def create_workorder(
+    request: Request,
     folder_name: str = Form(...),
     json_data: str = Form(...),
-    pdf_file: UploadFile = File(...)
+    pdf_file: UploadFile = File(...),
+    db: Session = Depends(get_db)
 ):
-    print("=== Folder Name ===")
-    print(folder_name)
-
-    print("=== Raw JSON Data String ===")
-    print(json_data)
-
-    import json
+    folder_name = uploads.safe_filename(folder_name)
     try:
         data = json.loads(json_data)
-        print("=== Parsed JSON ===")
-        print(data)
     except Exception as e:
-        print("JSON parse error:", e)
+        logger.warning("Invalid work order JSON for %s: %s", folder_name, e)
         return {"error": "Invalid JSON"}
+    logger.debug("Work order %s received (%d bytes of JSON)", folder_name, len(json_data))
 
-    # ✅ Create folder
-    folder_path = os.path.join("media", folder_name)
-    os.makedirs(folder_path, exist_ok=True)
+    # ✅ Stage the PDF (streamed to disk, never held in memory); nothing in the folder changes yet
+    staged_pdf = await uploads.stage_upload(MEDIA_ROOT, pdf_file)
 
-    # ✅ Save JSON
-    json_path = os.path.join(folder_path, f"{folder_name}.json")
-    with open(json_path, "w") as f:
-        json.dump(data, f, indent=4)
-
-    # ✅ Save PDF
-    pdf_path = os.path.join(folder_path, "workorder.pdf")
-    with open(pdf_path, "wb") as f:
-        f.write(await pdf_file.read())
-
-    return {"status": "saved", "folder": folder_name}
+    # ✅ Create folder (under media/YYYY/MM/ for dated folder names)
+    folder_path = media_layout.folder_path(MEDIA_ROOT, folder_name)
+    created = not await run_in_threadpool(os.path.isdir, folder_path)
+    await run_in_threadpool(os.makedirs, folder_path, exist_ok=True)
 
+    # ✅ Save JSON through the store like every other writer: folder lock, If-Match when sent,
+    # the replaced version kept in .history, catalog in step. The PDF is renamed in only after
+    # If-Match passes. Off the event loop, since the fsync, the commit and the locks would
+    # otherwise stall every other request
+    body = json.dumps(data, indent=4).encode()
+    try:
+        etag, _ = await run_in_threadpool(
+            workorder_store.save, db, MEDIA_ROOT, folder_name, lambda current: (body, data),
+            request.headers.get("if-match"), files={"workorder.pdf": staged_pdf},
+        )
+    except BaseException:
+        await run_in_threadpool(_discard_create, staged_pdf, folder_path if created else None)
+        raise
+
+    return {"status": "saved", "folder": folder_name, "etag": etag}
+
+
+def _discard_create(staged_pdf, new_folder):
+    # A failed create leaves nothing behind: the staged PDF goes, and so does a folder it made
+    if os.path.exists(staged_pdf):
+        os.remove(staged_pdf)
+    if new_folder:
+        try:
+            os.rmdir(new_folder)  # only if still empty; a concurrent create may have filled it
+        except OSError:
+            pass
 
 @router.get("/travel-time/")
-def get_travel_time_partial(location: str, db: Session = Depends(get_db)):
-    results = db.query(Travel).filter(Travel.location.ilike(f"%{location}%")).all()
-    return [
-        {
-            "location": travel.location,
-            "travel_time_hours": travel.travel_time_hours
-        }
-        for travel in results
-    ]
+def get_travel_time_partial(location: str, limit: int = Query(20, ge=1, le=200)):
+    # 🔎 Served from the in-memory index, no database round trip per keystroke
+    return travel_index.search(location, limit)
 
 @router.post("/travel/")
 def add_travel(location: str = Form(...), travel_time_hours: float = Form(...), db: Session = Depends(get_db)):
@@ -87,8 +106,11 @@ def add_travel(location: str = Form(...), travel_time_hours: float = Form(...),
         travel_time_hours=travel_time_hours
     )
     db.add(new_travel)
+    db.flush()
+    changes.record(db, "travel", new_travel.id)
     db.commit()
     db.refresh(new_travel)
+    index_travel(new_travel)
     return {"message": "Travel entry added", "travel": new_travel}
 
 @router.put("/travel/{travel_id}")
@@ -99,8 +121,10 @@ def update_travel(travel_id: int, location: str = Form(...), travel_time_hours:
 
     travel.location = location
     travel.travel_time_hours = travel_time_hours
+    changes.record(db, "travel", travel_id)
 
     db.commit()
+    index_travel(travel)
     return {"message": "Travel entry updated", "travel": travel}
 
 @router.delete("/travel/{travel_id}")
@@ -110,24 +134,16 @@ def delete_travel(travel_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Travel entry not found")
 
     db.delete(travel)
+    changes.record(db, "travel", travel_id, "delete")
     db.commit()
+    travel_index.remove(travel_id)
     return {"message": "Travel entry deleted"}
 
 
 @router.get("/parts/")
-def get_matching_parts(part_name: str, db: Session = Depends(get_db)):
-    results = db.query(Part).filter(Part.part_name.ilike(f"%{part_name}%")).all()
-    return [
-        {
-            "part_id": part.part_id,
-            "part_name": part.part_name,
-            "part_number": part.part_number,
-            "unit_cost": part.unit_cost,
-            "unit_price": part.unit_price,
-            "part_pic": part.part_pic
-        }
-        for part in results
-    ]
+def get_matching_parts(part_name: str, limit: int = Query(20, ge=1, le=200)):
+    # 🔎 Matches on part name or part number, best matches first
+    return parts_index.search(part_name, limit)
 
 @router.post("/parts/")
 def add_part(part_name: str = Form(...), part_number: str = Form(...), unit_cost: float = Form(...), unit_price: float = Form(...), part_pic: str = Form(...), db: Session = Depends(get_db)):
@@ -139,8 +155,11 @@ def add_part(part_name: str = Form(...), part_number: str = Form(...), unit_cost
         part_pic=part_pic
     )
     db.add(new_part)
+    db.flush()
+    changes.record(db, "part", new_part.part_id)
     db.commit()
     db.refresh(new_part)
+    index_part(new_part)
     return {"message": "Part added", "part": new_part}
 
 @router.put("/parts/{part_id}")
@@ -154,8 +173,10 @@ def update_part(part_id: int, part_name: str = Form(...), part_number: str = For
     part.unit_cost = unit_cost
     part.unit_price = unit_price
     part.part_pic = part_pic
+    changes.record(db, "part", part_id)
 
     db.commit()
+    index_part(part)
     return {"message": "Part updated", "part": part}
 
 @router.delete("/parts/{part_id}")
@@ -165,42 +186,95 @@ def delete_part(part_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Part not found")
 
     db.delete(part)
+    changes.record(db, "part", part_id, "delete")
     db.commit()
+    parts_index.remove(part_id)
     return {"message": "Part deleted"}
 
 
+# 🔎 Ranked full-text search over every field of the work orders, typo and prefix tolerant
 @router.get("/search-workorders/")
-def search_workorders(query: str):
-    matching = []
-
-    for folder in os.listdir(MEDIA_ROOT):
-        folder_path = os.path.join(MEDIA_ROOT, folder)
-        json_file = os.path.join(folder_path, f"{folder}.json")
-
-        if os.path.exists(json_file):
-            with open(json_file, "r") as f:
-                data = json.load(f)
-                if (
-                    query.lower() in data.get("customer", "").lower()
-                    or query.lower() in data.get("site_address", "").lower()
-                    or query.lower() in data.get("po_number", "").lower()
-                    or query.lower() in data.get("site_contact", "").lower()
-                ):
-                    matching.append({
-                        "folder": folder,
-                        "customer": data.get("customer", "N/A"),
-                        "site_address": data.get("site_address", "N/A"),
-                        "po_number": data.get("po_number", "N/A"),
-                        "site_contact": data.get("site_contact", "N/A"),
-                    })
-
-    return {"matches": matching}
-app = FastAPI()
+def search_workorders(
+    request: Request,
+    query: str = Query(..., min_length=1),
+    technician: str | None = None,
+    status: str | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_read_db)
+):
+    total, hits, terms = search.index.search(query, technician, status, date_from, date_to, limit, offset)
+    documents = catalog.documents(db, [folder for folder, _ in hits])
+
+    matches = []
+    for folder, score in hits:
+        data = documents.get(folder, {})
+        matches.append({
+            "folder": folder,
+            "score": round(score, 3),
+            "customer": data.get("customer") or "N/A",
+            "site_address": data.get("siteAddress") or data.get("site_address") or "N/A",
+            "po_number": data.get("purchaseOrderNumber") or data.get("po_number") or "N/A",
+            "site_contact": data.get("siteContact") or data.get("site_contact") or "N/A",
+            "technician": data.get("technician"),
+            "date": data.get("date"),
+            "status": data.get("jobStatus") or data.get("job_status"),
+            "snippets": search.snippets(data, terms),
+        })
+
+    return json_response(request, {"total": total, "limit": limit, "offset": offset, "matches": matches})
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Sync routes share this threadpool; size it against the DB pool rather than anyio's default 40
+    if os.getenv("THREADPOOL_SIZE"):
+        anyio.to_thread.current_default_thread_limiter().total_tokens = int(os.getenv("THREADPOOL_SIZE"))
+
+    Base.metadata.create_all(bind=engine)
+    # create_all skips indexes on tables that already exist
+    with engine.begin() as conn:
+        conn.execute(CreateIndex(part_name_lookup, if_not_exists=True))
+
+    # Saved search index first, so the sync below only re-indexes what changed
+    search.index.load(search.SEARCH_INDEX_PATH)
+    # Pick up folders written or removed while the server was down
+    db = SessionLocal()
+    try:
+        catalog.sync_catalog(db, MEDIA_ROOT)
+        rollups.backfill(db)
+        changes.prune(db)
+        db.commit()
+        load_indexes(db)
+        # Covers a first start, or an index file lost or older than the catalog
+        search.index.reconcile(db)
+    finally:
+        db.close()
+    if search.index.dirty:
+        search.index.save(search.SEARCH_INDEX_PATH)
+    uploads.purge_stale_uploads(MEDIA_ROOT)
+
+    outbox.start()
+    derivatives.start()
+    yield
+    derivatives.stop()
+    outbox.stop()
+    if search.index.dirty:
+        search.index.save(search.SEARCH_INDEX_PATH)
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(router)
-MEDIA_ROOT = "media"
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESS_MIN_BYTES", "1024")))
+# Oversized bodies are refused before the multipart parser spools them to disk
+app.add_middleware(uploads.RequestSizeLimit)
+# Outermost, so request timings include compression
+app.add_middleware(MetricsMiddleware)
 os.makedirs(MEDIA_ROOT, exist_ok=True)
 
-app.mount("/media", StaticFiles(directory=MEDIA_ROOT), name="media")
+app.mount("/media", MediaFiles(directory=MEDIA_ROOT), name="media")
 
 
 # 1. Upload workorder PDF + JSON
@@ -209,105 +283,401 @@ app.mount("/media", StaticFiles(directory=MEDIA_ROOT), name="media")
 # 2. Upload Images
 @app.post("/upload-images/")
 async def upload_images(folder_name: str = Form(...), files: list[UploadFile] = File(...)):
-    folder_path = os.path.join(MEDIA_ROOT, folder_name)
+    # The request size cap is enforced by uploads.RequestSizeLimit before the form is parsed
+    # Sanitised once: the files and the email must both refer to the folder actually written
+    folder_name = uploads.safe_filename(folder_name)
+    folder_path = media_layout.folder_path(MEDIA_ROOT, folder_name)
     os.makedirs(folder_path, exist_ok=True)
 
     saved_files = []
+    remaining = uploads.MAX_REQUEST_BYTES
     for img in files:
-        img_path = os.path.join(folder_path, img.filename)
-        with open(img_path, "wb") as f:
-            shutil.copyfileobj(img.file, f)
-        saved_files.append(img.filename)
+        filename = uploads.safe_filename(img.filename)
+        img_path = os.path.join(folder_path, filename)
+        remaining -= await uploads.save_upload(img, img_path, min(uploads.MAX_FILE_BYTES, remaining))
+        saved_files.append(filename)
+
+    derivatives.schedule(folder_path, saved_files)
+    await notify_upload(folder_name, saved_files)
+    return {"message": "Images uploaded", "files": saved_files}
 
-    # 📬 Load workorder JSON (if it exists) and send email
+
+async def notify_upload(folder_name, saved_files):
+    folder_path = media_layout.folder_path(MEDIA_ROOT, folder_name)
+
+    # 📬 Load workorder JSON (if it exists) and queue the notification email
     json_path = os.path.join(folder_path, f"{folder_name}.json")
+    workorder_subject_number = "N/A"
     if os.path.exists(json_path):
-        with open(json_path, "r") as jf:
-            workorder_data = json.load(jf)
-            workorder_subject_number = f"{workorder_data.get('work_order_number', 'N/A')}"
-            workorder_info = f"Customer: {workorder_data.get('customer', 'N/A')}\nSite Address: {workorder_data.get('site_address', 'N/A')}\nStatus: {workorder_data.get('job_status', 'N/A')}"
+        with open(json_path, "rb") as jf:
+            body = jf.read()
+            metrics.fs_read(len(body))
+            workorder_data = json.loads(body)
+            workorder_subject_number = f"{workorder_data.get('workOrderNumber') or workorder_data.get('work_order_number', 'N/A')}"
+            customer = workorder_data.get('customer', 'N/A')
+            site_address = workorder_data.get('siteAddress') or workorder_data.get('site_address', 'N/A')
+            status = workorder_data.get('jobStatus') or workorder_data.get('job_status', 'N/A')
+            workorder_info = f"Customer: {customer}\nSite Address: {site_address}\nStatus: {status}"
     else:
         workorder_info = "No workorder data found."
 
-    folder_url = f"http://127.0.0.1:8000/album/{folder_name}/"
+    folder_url = f"{PUBLIC_BASE_URL}/album/{quote(folder_name)}/"
     current_date = datetime.now().strftime("%m/%d/%Y")
-    send_email(
-        subject=f"{current_date} - {workorder_subject_number}",
-        body=f"{workorder_info}\n\nFiles available at: {folder_url}"
+    await run_in_threadpool(
+        outbox.enqueue,
+        folder_name,
+        f"{current_date} - {workorder_subject_number}",
+        f"{workorder_info}\n\nFiles available at: {folder_url}\nDownload everything (ZIP): {PUBLIC_BASE_URL}/workorder/{quote(folder_name)}/archive",
+        saved_files
     )
 
-    return {"message": "Images uploaded", "files": saved_files}
 
-from fastapi import UploadFile, File, Form
+# 3. Resumable chunked uploads: init -> PUT chunks at offset -> commit
+@app.post("/uploads/")
+def init_chunked_upload(folder_name: str = Form(...), filename: str = Form(...), size: int = Form(...)):
+    return uploads.init_upload(MEDIA_ROOT, folder_name, filename, size)
+
+@app.get("/uploads/{upload_id}")
+def chunked_upload_status(upload_id: str):
+    return uploads.upload_status(MEDIA_ROOT, upload_id)
+
+@app.put("/uploads/{upload_id}")
+async def put_upload_chunk(upload_id: str, request: Request, offset: int = Query(..., ge=0)):
+    return await uploads.put_chunk(MEDIA_ROOT, upload_id, offset, request.stream())
+
+@app.post("/uploads/{upload_id}/commit")
+async def commit_chunked_upload(upload_id: str):
+    folder_name, filename = await uploads.commit_upload(
+        MEDIA_ROOT, upload_id, lambda name: media_layout.folder_path(MEDIA_ROOT, name)
+    )
+    derivatives.schedule(media_layout.folder_path(MEDIA_ROOT, folder_name), [filename])
+    await notify_upload(folder_name, [filename])
+    return {"message": "Upload complete", "folder": folder_name, "file": filename}
+
+@app.delete("/uploads/{upload_id}")
+def abort_chunked_upload(upload_id: str):
+    uploads.abort_upload(MEDIA_ROOT, upload_id)
+    return {"message": "Upload aborted"}
 
 @app.put("/workorder/")
 def update_workorder(
+    request: Request,
+    response: Response,
     folder_name: str = Form(...),
-    updated_json: UploadFile = File(...)
+    updated_json: UploadFile = File(...),
+    db: Session = Depends(get_db)
+):
+    folder_name = uploads.safe_filename(folder_name)
+
+    # 🧩 Validate before touching the stored file
+    body = updated_json.file.read()
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON"})
+
+    # ✅ Replace it atomically (temp file + fsync + rename); If-Match is honoured when sent
+    etag, _ = workorder_store.save(
+        db, MEDIA_ROOT, folder_name, lambda current: (body, data), request.headers.get("if-match")
+    )
+    response.headers["ETag"] = etag
+    return {"message": "Workorder JSON successfully updated", "path": workorder_store.json_path(MEDIA_ROOT, folder_name), "etag": etag}
+
+# ✏️ Partial update: JSON Merge Patch (RFC 7396) against the version the client loaded
+@app.patch("/workorder/{folder_name}")
+def patch_workorder(
+    folder_name: str,
+    request: Request,
+    patch: dict = Body(..., media_type="application/merge-patch+json"),
+    db: Session = Depends(get_db)
 ):
-    workorder_path = os.path.join(MEDIA_ROOT, folder_name)
-    json_path = os.path.join(workorder_path, f"{folder_name}.json")
+    folder_name = uploads.safe_filename(folder_name)
+
+    def apply(current):
+        if current is None:
+            raise HTTPException(status_code=404, detail="Workorder not found")
+        data = workorder_store.merge_patch(json.loads(current), patch)
+        return json.dumps(data, indent=4).encode(), data
+
+    etag, body = workorder_store.save(
+        db, MEDIA_ROOT, folder_name, apply, request.headers.get("if-match"), require_match=True
+    )
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+@app.get("/workorder/{folder_name}/history")
+def workorder_history(folder_name: str):
+    return {"versions": workorder_store.history(MEDIA_ROOT, uploads.safe_filename(folder_name))}
+
+@app.get("/workorder/{folder_name}/history/{version}")
+def workorder_version(folder_name: str, version: str):
+    body = workorder_store.read_version(MEDIA_ROOT, uploads.safe_filename(folder_name), version)
+    return Response(content=body, media_type="application/json", headers={"ETag": workorder_store.etag_of(body)})
+
+@app.post("/workorder/{folder_name}/rollback/{version}")
+def rollback_workorder(folder_name: str, version: str, request: Request, db: Session = Depends(get_db)):
+    # The version being replaced goes into the history too, so a rollback can itself be undone
+    folder_name = uploads.safe_filename(folder_name)
+    body = workorder_store.read_version(MEDIA_ROOT, folder_name, version)
+    etag, body = workorder_store.save(
+        db, MEDIA_ROOT, folder_name, lambda current: (body, json.loads(body)), request.headers.get("if-match")
+    )
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
 
-    # 🧩 Check if the folder exists
-    if not os.path.exists(workorder_path):
-        return JSONResponse(status_code=404, content={"error": "Workorder folder not found"})
+@app.post("/admin/import/{kind}")
+def import_catalogue(
+    kind: str,
+    csv_file: UploadFile = File(...),
+    delete_missing: bool = Form(False),
+    dry_run: bool = Form(False),
+    db: Session = Depends(get_db)
+):
+    if kind not in importer.SPECS:
+        raise HTTPException(status_code=404, detail=f"Unknown catalogue '{kind}'")
 
-    # ✅ Overwrite the existing JSON file
+    source = io.TextIOWrapper(csv_file.file, encoding="utf-8-sig", newline="")
     try:
-        with open(json_path, "wb") as f:
-            shutil.copyfileobj(updated_json.file, f)
-        return {"message": "Workorder JSON successfully updated", "path": json_path}
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
+        report = importer.import_csv(kind, source, delete_missing, dry_run)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        source.detach()
+
+    if not dry_run:
+        load_indexes(db)
+    return report
+
+
+@app.post("/admin/search/rebuild")
+def rebuild_search(db: Session = Depends(get_db)):
+    # Re-reads changed JSON from disk into the catalog, then indexes every work order from scratch
+    catalog.sync_catalog(db, MEDIA_ROOT)
+    count = search.index.rebuild(db)
+    search.index.save(search.SEARCH_INDEX_PATH)
+    return {"workorders": count, "terms": search.index.terms}
+
+
+@app.post("/admin/rollups/rebuild")
+def rebuild_rollups(db: Session = Depends(get_db)):
+    # Reprices every work order against the current parts catalogue
+    return {"workorders": rollups.backfill(db, rebuild=True)}
+
+
+# 📲 Offline sync: a client keeps the cursor from its last sync and asks only for what changed
+@app.get("/changes")
+def changes_since(
+    request: Request,
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=5000),
+    db: Session = Depends(get_read_db)
+):
+    return json_response(request, changes.feed(db, since, limit))
 
+@app.get("/catalogue/{kind}")
+def catalogue_snapshot(kind: str, request: Request, db: Session = Depends(get_read_db)):
+    # Whole parts/travel catalogue as compact rows for on-device autocomplete; 304 until it changes
+    if kind not in changes.CATALOGUES:
+        raise HTTPException(status_code=404, detail=f"Unknown catalogue '{kind}'")
+    version, cursor, body, etag, encoded = changes.snapshots.get(db, kind)
+    return encoded_response(request, body, etag, encoded)
+
+
+@app.get("/admin/db-pool")
+def db_pool_status():
+    return pool_stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
-@app.get("/album/{folder_name}", response_class=HTMLResponse)
-def album(folder_name: str):
-    folder_path = os.path.join(MEDIA_ROOT, folder_name)
-    if not os.path.exists(folder_path):
-        return HTMLResponse(f"<h2>Folder '{folder_name}' not found.</h2>", status_code=404)
 
-    files = os.listdir(folder_path)
-    images = [f for f in files if f.lower().endswith((".jpg", ".jpeg", ".png", ".heic", ".webp", ".gif"))]
+@app.get("/outbox")
+def outbox_status():
+    return outbox.stats()
 
-    html_content = f"<h2>Album: {folder_name}</h2><div style='display:flex;flex-wrap:wrap;gap:12px;'>"
-    for img in images:
-        img_url = f"/media/{folder_name}/{img}"
-        html_content += f"<div><img src='{img_url}' style='max-width:200px'><p>{img}</p></div>"
+
+@app.get("/album/{folder_name}", response_class=HTMLResponse)
+def album(folder_name: str, page: int = Query(1, ge=1), per_page: int = Query(48, ge=1, le=200)):
+    folder_path = media_layout.folder_path(MEDIA_ROOT, folder_name)
+    if not os.path.exists(folder_path):
+        return HTMLResponse(f"<h2>Folder '{html.escape(folder_name)}' not found.</h2>", status_code=404)
+
+    metrics.dir_scan()
+    files = sorted(os.listdir(folder_path))
+    media = [f for f in files if f.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS)]
+    pages = max(1, -(-len(media) // per_page))
+    page_items = media[(page - 1) * per_page:page * per_page]
+
+    # 🖼 Thumbnails where they exist; pending ones fall back to the lazily loaded original
+    ready = derivatives.lookup(folder_path, page_items)
+    base_url = f"/media/{quote(media_layout.relative_url_path(MEDIA_ROOT, folder_name))}"
+
+    html_content = f"<h2>Album: {html.escape(folder_name)}</h2>"
+    html_content += f"<p><a href='/workorder/{quote(folder_name)}/archive'>Download all (ZIP)</a></p><div style='display:flex;flex-wrap:wrap;gap:12px;'>"
+    for name in page_items:
+        original_url = f"{base_url}/{quote(name)}"
+        entry = ready.get(name)
+        if entry and "thumb" in entry:
+            thumb_url = f"{base_url}/{DERIVATIVES_DIRNAME}/{entry['thumb']}"
+            link_url = original_url if name.lower().endswith(VIDEO_EXTENSIONS) else f"{base_url}/{DERIVATIVES_DIRNAME}/{entry['preview']}"
+            preview = f"<a href='{link_url}'><img src='{thumb_url}' loading='lazy' style='max-width:200px'></a>"
+        elif name.lower().endswith((".heic",) + VIDEO_EXTENSIONS):
+            # Browsers can't render these inline; link to the original instead
+            preview = f"<a href='{original_url}'>Open</a>"
+        else:
+            preview = f"<a href='{original_url}'><img src='{original_url}' loading='lazy' style='max-width:200px'></a>"
+        html_content += f"<div>{preview}<p>{html.escape(name)}</p></div>"
     html_content += "</div>"
 
+    if pages > 1:
+        album_url = f"/album/{quote(folder_name)}"
+        nav = []
+        if page > 1:
+            nav.append(f"<a href='{album_url}?page={page - 1}&per_page={per_page}'>&laquo; Previous</a>")
+        nav.append(f"Page {page} of {pages}")
+        if page < pages:
+            nav.append(f"<a href='{album_url}?page={page + 1}&per_page={per_page}'>Next &raquo;</a>")
+        html_content += f"<p>{' | '.join(nav)}</p>"
+
     return HTMLResponse(content=html_content)
 
 @app.get("/workorders")
-def list_workorders():
+def list_workorders(
+    request: Request,
+    technician: str | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    week_from: int | None = None,
+    week_to: int | None = None,
+    fields: str | None = Query(None, description="Comma-separated field names, or * for the full document"),
+    limit: int | None = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    month: str | None = Query(None, pattern=r"^\d{4}-\d{2}$", description="Only folders of this month (YYYY-MM)"),
+    db: Session = Depends(get_read_db)
+):
+    filtered = any(v is not None for v in (technician, date_from, date_to, week_from, week_to, fields, limit)) or offset
+    if filtered:
+        # 📇 Served from the catalog: one round trip instead of a request per folder
+        limit = limit or 100
+        field_list = [name.strip() for name in fields.split(",") if name.strip()] if fields else None
+        total, items = catalog.query_workorders(
+            db, technician, date_from, date_to, week_from, week_to, field_list, limit, offset
+        )
+        next_offset = offset + len(items)
+        return json_response(request, {
+            "workorders": items,
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+            "next_offset": next_offset if next_offset < total else None,
+        })
+
     try:
-        folders = [
-            name for name in os.listdir(MEDIA_ROOT)
-            if os.path.isdir(os.path.join(MEDIA_ROOT, name))
-        ]
-        return {"workorders": folders}
+        # 📁 A month only reads media/YYYY/MM; new folders no longer touch the root's mtime,
+        # so revalidation goes by ETag alone
+        folders = [name for name, _ in media_layout.iter_folders(MEDIA_ROOT, month)]
+        return json_response(request, {"workorders": folders})
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+@app.get("/workorders/archive")
+def workorders_archive(
+    folders: list[str] | None = Query(None, description="Folder names (repeat the parameter or comma-separate)"),
+    technician: str | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    month: str | None = Query(None, pattern=r"^\d{4}-\d{2}$"),
+    db: Session = Depends(get_read_db)
+):
+    if folders:
+        names = [uploads.safe_filename(name.strip()) for value in folders for name in value.split(",") if name.strip()]
+        label = "workorders"
+    else:
+        if month:
+            year, mm = map(int, month.split("-"))
+            date_from, date_to = date(year, mm, 1), date(year, mm, calendar.monthrange(year, mm)[1])
+        if not (technician or date_from or date_to):
+            raise HTTPException(status_code=400, detail="Pick folders, a technician, a month or a date range")
+        names = catalog.folder_names(db, technician, date_from, date_to)
+        label = "-".join(str(part) for part in ("workorders", technician, month or date_from, None if month else date_to) if part)
+    names = [name for name in names if os.path.isdir(media_layout.folder_path(MEDIA_ROOT, name))]
+    if not names:
+        raise HTTPException(status_code=404, detail="No matching work orders")
+    # Folders are listed one at a time while streaming, so a month of jobs runs in constant memory
+    return StreamingResponse(
+        archive.stream_zip(archive.workorders_entries(MEDIA_ROOT, names)),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{quote(label)}.zip"'},
+    )
+
+# 📊 Reports: answered from the rollup tables, which are kept current on every save/delete
+@app.get("/reports/technician-weeks")
+def technician_week_report(
+    request: Request,
+    technician: str | None = None,
+    year: int | None = None,
+    week_from: int | None = None,
+    week_to: int | None = None,
+    db: Session = Depends(get_read_db)
+):
+    return json_response(request, rollups.technician_weeks(db, technician, year, week_from, week_to))
+
+@app.get("/reports/customer-months")
+def customer_month_report(
+    request: Request,
+    customer: str | None = None,
+    month_from: str | None = Query(None, pattern=r"^\d{4}-\d{2}$"),
+    month_to: str | None = Query(None, pattern=r"^\d{4}-\d{2}$"),
+    db: Session = Depends(get_read_db)
+):
+    return json_response(request, rollups.customer_months(db, customer, month_from, month_to))
+
+def csv_download(rows, filename):
+    return StreamingResponse(
+        rows, media_type="text/csv", headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/reports/timesheet.csv")
+def timesheet_export(technician: str | None = None, date_from: date | None = None, date_to: date | None = None):
+    # The export opens its own session: it is still streaming after the route has returned
+    return csv_download(rollups.timesheet_csv(SessionLocal, technician, date_from, date_to), "timesheet.csv")
+
+@app.get("/reports/billing.csv")
+def billing_export(customer: str | None = None, date_from: date | None = None, date_to: date | None = None):
+    return csv_download(rollups.billing_csv(SessionLocal, customer, date_from, date_to), "billing.csv")
+
+
 @app.get("/workorder/{folder_name}")
-def get_workorder(folder_name: str):
-    json_path = os.path.join(MEDIA_ROOT, folder_name, f"{folder_name}.json")
+def get_workorder(folder_name: str, request: Request):
+    json_path = os.path.join(media_layout.folder_path(MEDIA_ROOT, folder_name), f"{folder_name}.json")
     if not os.path.exists(json_path):
         return JSONResponse(status_code=404, content={"error": "Workorder not found"})
-    with open(json_path) as f:
-        data = json.load(f)
-    return data
-
-@app.delete("/workorder/{folder_name}")
-def delete_workorder(folder_name: str):
-    folder_path = os.path.join(MEDIA_ROOT, folder_name)
-
-    if not os.path.exists(folder_path):
+    # 🗂 Served as stored, with an ETag so unchanged orders come back as 304
+    return json_file_response(request, json_path)
+
+# 🗜 ZIP of the JSON, PDF and media, streamed as it is built (nothing staged on disk or in memory)
+@app.get("/workorder/{folder_name}/archive")
+def workorder_archive(folder_name: str, request: Request):
+    folder_name = uploads.safe_filename(folder_name)
+    if not os.path.isdir(media_layout.folder_path(MEDIA_ROOT, folder_name)):
         raise HTTPException(status_code=404, detail="Workorder not found")
+    entries = archive.folder_entries(MEDIA_ROOT, folder_name)
+    etag, last_modified = archive.fingerprint(entries)
+    return conditional_stream(
+        request, archive.stream_zip(entries), etag, last_modified, "application/zip",
+        {"Content-Disposition": f'attachment; filename="{folder_name}.zip"'},
+    )
 
+@app.delete("/workorder/{folder_name}")
+def delete_workorder(folder_name: str, db: Session = Depends(get_db)):
+    folder_name = uploads.safe_filename(folder_name)
     try:
-        shutil.rmtree(folder_path)
+        # Same folder lock as the JSON writers, so a delete never interleaves with a save
+        workorder_store.delete(db, MEDIA_ROOT, folder_name)
         return {"message": f"Workorder '{folder_name}' deleted successfully."}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting workorder: {str(e)}")
 
@@ -0,0 +1,222 @@
+"""Date-partitioned media layout: MEDIA_ROOT/YYYY/MM/<YYYYMMDD_number>/.
+
+Folders whose names don't start with a date stay at the top level. Until the migration has
+run, folders may still sit flat under MEDIA_ROOT; folder_path() checks the partition first
+and falls back to the flat location, so every route works during and after the move.
+
+    python media_layout.py migrate              # move flat folders into partitions (resumable)
+    python media_layout.py migrate --finalize   # then drop the compatibility symlinks
+    python media_layout.py status
+"""
+import os, re, sys, json, time, shutil, argparse
+import metrics
+
+LAYOUT_MARKER = ".layout"
+_DATED = re.compile(r"^(\d{4})(\d{2})\d{2}_")
+_YEAR = re.compile(r"^\d{4}$")
+_MONTH = re.compile(r"^\d{2}$")
+
+
+def partition(folder_name):
+    """"YYYY/MM" for a YYYYMMDD_<number> folder name, else None."""
+    match = _DATED.match(folder_name)
+    if match and 1 <= int(match.group(2)) <= 12:
+        return f"{match.group(1)}/{match.group(2)}"
+    return None
+
+
+def partitioned_path(media_root, folder_name):
+    part = partition(folder_name)
+    return os.path.join(media_root, part, folder_name) if part else os.path.join(media_root, folder_name)
+
+
+def folder_path(media_root, folder_name):
+    """Where a work-order folder lives: its partition if it is there, else the flat legacy spot.
+
+    New folders (neither exists yet) are placed in their partition.
+    """
+    path = partitioned_path(media_root, folder_name)
+    if os.path.isdir(path):
+        return path
+    legacy = os.path.join(media_root, folder_name)
+    if os.path.isdir(legacy):
+        return legacy
+    return path
+
+
+def relative_url_path(media_root, folder_name):
+    """Path of the folder relative to MEDIA_ROOT, with forward slashes, for /media URLs."""
+    return os.path.relpath(folder_path(media_root, folder_name), media_root).replace(os.sep, "/")
+
+
+def is_partitioned(media_root):
+    return os.path.exists(os.path.join(media_root, LAYOUT_MARKER))
+
+
+def _scandir(path):
+    metrics.dir_scan()
+    try:
+        with os.scandir(path) as entries:
+            return sorted(entries, key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return []
+
+
+def iter_folders(media_root, month=None):
+    """Yield (folder_name, path) for every work-order folder, or only those of month "YYYY-MM".
+
+    A month listing reads just MEDIA_ROOT/YYYY/MM once the migration has finished; before
+    that the flat top level is checked too. Compatibility symlinks are skipped.
+    """
+    if month is not None:
+        year, mm = month.split("-")
+        for entry in _scandir(os.path.join(media_root, year, mm)):
+            if entry.is_dir(follow_symlinks=False) and not entry.name.startswith("."):
+                yield entry.name, entry.path
+        if is_partitioned(media_root):
+            return
+        prefix = f"{year}{mm}"
+        for entry in _scandir(media_root):
+            if entry.name.startswith(prefix) and entry.is_dir(follow_symlinks=False):
+                yield entry.name, entry.path
+        return
+
+    for entry in _scandir(media_root):
+        if entry.name.startswith(".") or not entry.is_dir(follow_symlinks=False):
+            continue
+        if not _YEAR.match(entry.name):
+            yield entry.name, entry.path
+            continue
+        for month_entry in _scandir(entry.path):
+            if not _MONTH.match(month_entry.name) or not month_entry.is_dir(follow_symlinks=False):
+                continue
+            for folder in _scandir(month_entry.path):
+                if folder.is_dir(follow_symlinks=False) and not folder.name.startswith("."):
+                    yield folder.name, folder.path
+
+
+# Migration. Each folder is moved with one rename (same filesystem, so it is atomic) and a
+# relative symlink is left at the old path, so a request that resolved the flat path a moment
+# earlier - or an old client still writing there - lands in the new folder. All state is on
+# disk, so an interrupted run just picks up where it stopped.
+
+def _merge_into(src, dest):
+    # A writer recreated the flat folder between our rename and symlink: fold its files in
+    for name in os.listdir(src):
+        target = os.path.join(dest, name)
+        if os.path.isdir(os.path.join(src, name)) and os.path.isdir(target):
+            _merge_into(os.path.join(src, name), target)
+        else:
+            os.replace(os.path.join(src, name), target)
+    os.rmdir(src)
+
+
+def migrate_folder(media_root, folder_name):
+    """Move one flat folder into its partition; returns True if it moved."""
+    legacy = os.path.join(media_root, folder_name)
+    part = partition(folder_name)
+    if part is None or os.path.islink(legacy) or not os.path.isdir(legacy):
+        return False
+
+    dest = os.path.join(media_root, part, folder_name)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if os.path.isdir(dest):
+        # Left half-done by an earlier run (or a new upload already created it)
+        _merge_into(legacy, dest)
+    else:
+        os.rename(legacy, dest)
+
+    link_target = os.path.join(part, folder_name)
+    for _ in range(3):
+        try:
+            os.symlink(link_target, legacy, target_is_directory=True)
+            return True
+        except FileExistsError:
+            if os.path.islink(legacy):
+                return True
+            _merge_into(legacy, dest)
+    raise RuntimeError(f"{legacy} keeps being recreated; is an old client still writing to it?")
+
+
+def migrate(media_root, limit=None, dry_run=False, pause=0.0):
+    report = {"moved": 0, "skipped": 0, "remaining": 0, "errors": []}
+    for entry in _scandir(media_root):
+        if entry.name.startswith(".") or entry.is_symlink() or not entry.is_dir() or _YEAR.match(entry.name):
+            continue
+        if partition(entry.name) is None:
+            report["skipped"] += 1
+            continue
+        if dry_run or (limit is not None and report["moved"] >= limit):
+            report["remaining"] += 1
+            continue
+        try:
+            if migrate_folder(media_root, entry.name):
+                report["moved"] += 1
+                if pause:
+                    time.sleep(pause)
+        except (OSError, RuntimeError) as e:
+            report["errors"].append({"folder": entry.name, "error": str(e)})
+            report["remaining"] += 1
+    return report
+
+
+def finalize(media_root):
+    """Remove the compatibility symlinks and mark the tree as partitioned.
+
+    Refuses while flat dated folders remain. Old URLs keep working without the links:
+    MediaFiles and folder_path() resolve bare folder names to their partition.
+    """
+    remaining = migrate(media_root, dry_run=True)["remaining"]
+    if remaining:
+        raise RuntimeError(f"{remaining} folders still need migrating")
+    removed = 0
+    for entry in _scandir(media_root):
+        if entry.is_symlink() and partition(entry.name):
+            os.unlink(entry.path)
+            removed += 1
+    with open(os.path.join(media_root, LAYOUT_MARKER), "w") as f:
+        json.dump({"layout": "YYYY/MM", "finalized_at": time.time()}, f)
+    return removed
+
+
+def status(media_root):
+    flat = links = 0
+    for entry in _scandir(media_root):
+        if entry.name.startswith("."):
+            continue
+        if entry.is_symlink():
+            links += 1
+        elif entry.is_dir() and partition(entry.name):
+            flat += 1
+    return {
+        "flat_dated_folders": flat,
+        "compatibility_links": links,
+        "folders": sum(1 for _ in iter_folders(media_root)),
+        "finalized": is_partitioned(media_root),
+        "disk_free_bytes": shutil.disk_usage(media_root).free,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["migrate", "status"])
+    parser.add_argument("--media-root", default=os.getenv("MEDIA_ROOT", "media"))
+    parser.add_argument("--limit", type=int, help="move at most this many folders, then stop")
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between folders")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--finalize", action="store_true", help="after migrating, remove the compatibility symlinks")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        print(json.dumps(status(args.media_root), indent=2))
+        return 0
+
+    report = migrate(args.media_root, args.limit, args.dry_run, args.pause)
+    if args.finalize and not args.dry_run and not report["remaining"]:
+        report["links_removed"] = finalize(args.media_root)
+    print(json.dumps(report, indent=2))
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+import os, json, time, bisect, logging, threading
+from contextvars import ContextVar
+from sqlalchemy import event
+from database import engine, pool_stats
+
+logger = logging.getLogger("workorder.requests")
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+
+# Seconds; tuned for a Pi where most routes land between 1ms and 1s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats:
+    """Per-request counters, reached from any thread the request runs in via a ContextVar."""
+
+    __slots__ = ("sql_queries", "sql_seconds", "fs_read_bytes", "fs_written_bytes", "dir_scans")
+
+    def __init__(self):
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+        self.fs_read_bytes = 0
+        self.fs_written_bytes = 0
+        self.dir_scans = 0
+
+
+_current: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+# Filesystem accounting: called at the places that read/write media, not by patching os.
+# Outside a request (startup sync, background threads) these are no-ops.
+def fs_read(nbytes):
+    stats = _current.get()
+    if stats is not None:
+        stats.fs_read_bytes += nbytes
+
+
+def fs_written(nbytes):
+    stats = _current.get()
+    if stats is not None:
+        stats.fs_written_bytes += nbytes
+
+
+def dir_scan(count=1):
+    stats = _current.get()
+    if stats is not None:
+        stats.dir_scans += count
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is not None and conn.info.get("query_started"):
+        stats.sql_queries += 1
+        stats.sql_seconds += time.perf_counter() - conn.info["query_started"].pop()
+
+
+class _Histogram:
+    __slots__ = ("buckets", "sum", "count")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Request counters and latency histograms keyed by (method, route template)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_progress = 0
+        self.statuses = {}      # (method, route, status) -> count
+        self.latency = {}       # (method, route) -> _Histogram
+        self.totals = {}        # (method, route) -> [sql_queries, sql_seconds, read, written, scans, response_bytes]
+
+    def observe(self, method, route, status, seconds, stats, response_bytes):
+        key = (method, route)
+        with self._lock:
+            self.statuses[(method, route, status)] = self.statuses.get((method, route, status), 0) + 1
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = _Histogram()
+            histogram.observe(seconds)
+            totals = self.totals.setdefault(key, [0, 0.0, 0, 0, 0, 0])
+            totals[0] += stats.sql_queries
+            totals[1] += stats.sql_seconds
+            totals[2] += stats.fs_read_bytes
+            totals[3] += stats.fs_written_bytes
+            totals[4] += stats.dir_scans
+            totals[5] += response_bytes
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            statuses = sorted(self.statuses.items())
+            latency = sorted((key, list(h.buckets), h.sum, h.count) for key, h in self.latency.items())
+            totals = sorted((key, list(values)) for key, values in self.totals.items())
+            in_progress = self.in_progress
+
+        lines = [
+            "# HELP http_requests_total Requests handled, by route template and status.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status), value in statuses:
+            lines.append(f'http_requests_total{{method="{method}",route="{_escape(route)}",status="{status}"}} {value}')
+
+        lines += [
+            "# HELP http_request_duration_seconds Request latency, including middleware.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), buckets, total, count in latency:
+            labels = f'method="{method}",route="{_escape(route)}"'
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS, buckets):
+                cumulative += n
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"http_request_duration_seconds_sum{{{labels}}} {total:.6f}")
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {count}")
+
+        per_route = (
+            ("http_request_sql_queries_total", "SQL statements executed while handling requests.", 0),
+            ("http_request_sql_seconds_total", "Time spent in SQL statements while handling requests.", 1),
+            ("http_request_fs_read_bytes_total", "Bytes read from the media tree while handling requests.", 2),
+            ("http_request_fs_written_bytes_total", "Bytes written to the media tree while handling requests.", 3),
+            ("http_request_dir_scans_total", "Directory listings performed while handling requests.", 4),
+            ("http_response_bytes_total", "Response body bytes sent (after compression).", 5),
+        )
+        for name, help_text, index in per_route:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for (method, route), values in totals:
+                value = values[index]
+                value = f"{value:.6f}" if isinstance(value, float) else value
+                lines.append(f'{name}{{method="{method}",route="{_escape(route)}"}} {value}')
+
+        lines += [
+            "# HELP http_requests_in_progress Requests currently being handled.",
+            "# TYPE http_requests_in_progress gauge",
+            f"http_requests_in_progress {in_progress}",
+        ]
+
+        pool = pool_stats()
+        for name, key, kind in (
+            ("db_pool_connections_in_use", "in_use", "gauge"),
+            ("db_pool_checkouts_total", "checkouts", "counter"),
+            ("db_pool_timeouts_total", "timeouts", "counter"),
+            ("db_pool_wait_seconds_total", "wait_seconds_total", "counter"),
+        ):
+            lines += [f"# TYPE {name} {kind}", f"{name} {pool[key]}"]
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = Registry()
+
+
+def _route_label(scope, root_path):
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    mount = scope.get("root_path", "")
+    if mount != root_path:
+        # Mounted apps (/media) don't set a route; group them under the mount point
+        return f"{mount[len(root_path):]}/{{path}}"
+    # Unmatched paths get one label, so scanners can't blow up the series count
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Times every HTTP request and attributes SQL, filesystem and response bytes to its route.
+
+    Requests slower than SLOW_REQUEST_MS are logged as one JSON line on the workorder.requests logger.
+    """
+
+    def __init__(self, app, slow_request_ms=SLOW_REQUEST_MS):
+        self.app = app
+        self.slow_request_seconds = slow_request_ms / 1000
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        root_path = scope.get("root_path", "")
+        status = 500
+        response_bytes = 0
+
+        async def send_with_metrics(message):
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        registry.in_progress += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            elapsed = time.perf_counter() - started
+            registry.in_progress -= 1
+            _current.reset(token)
+            route = _route_label(scope, root_path)
+            registry.observe(scope["method"], route, status, elapsed, stats, response_bytes)
+            if elapsed >= self.slow_request_seconds:
+                logger.warning(json.dumps({
+                    "event": "slow_request",
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "query": scope.get("query_string", b"").decode("latin-1"),
+                    "route": route,
+                    "status": status,
+                    "ms": round(elapsed * 1000, 1),
+                    "sql_queries": stats.sql_queries,
+                    "sql_ms": round(stats.sql_seconds * 1000, 1),
+                    "fs_read_bytes": stats.fs_read_bytes,
+                    "fs_written_bytes": stats.fs_written_bytes,
+                    "dir_scans": stats.dir_scans,
+                    "response_bytes": response_bytes,
+                }))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float
+from sqlalchemy import Column, Integer, String, Float, Date, JSON, Index, Text, func
 from database import Base
 
 class Travel(Base):
@@ -17,4 +17,97 @@ class Part(Base):
     unit_cost = Column(Float)
     unit_price = Column(Float)
     part_pic = Column(String)  # This could be a filename or URL
-# vidy was here
\ No newline at end of file
+
+# Rollups price work-order part lines by case-insensitive name
+part_name_lookup = Index("ix_parts_part_name_lower", func.lower(Part.part_name))
+# vidy was here
+
+class WorkOrder(Base):
+    # Catalog of work-order metadata mirrored from media/<folder>/<folder>.json
+    __tablename__ = "workorders"
+    __table_args__ = (
+        Index("ix_workorders_technician_date", "technician", "date"),
+    )
+
+    folder_name = Column(String, primary_key=True)
+    technician = Column(String, index=True)
+    date = Column(Date, index=True)
+    week = Column(Integer, index=True)
+    customer = Column(String)
+    status = Column(String)
+    mtime = Column(Float, nullable=False)
+    data = Column(JSON)
+
+class OutboxEmail(Base):
+    # Notification emails waiting to be sent by the background outbox sender
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    folder_name = Column(String, index=True, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    files = Column(JSON)
+    status = Column(String, index=True, nullable=False, default="pending")  # pending / sent / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(Float, nullable=False)
+    next_attempt_at = Column(Float, nullable=False)
+    sent_at = Column(Float)
+    last_error = Column(String)
+
+class WorkOrderContribution(Base):
+    # What one work order adds to the rollups, so an edit or delete can subtract it again
+    __tablename__ = "rollup_contributions"
+    __table_args__ = (
+        Index("ix_rollup_contributions_technician_date", "technician", "date"),
+        Index("ix_rollup_contributions_customer_date", "customer", "date"),
+    )
+
+    folder_name = Column(String, primary_key=True)
+    technician = Column(String, nullable=False, default="")
+    customer = Column(String, nullable=False, default="")
+    date = Column(Date)
+    year = Column(Integer)
+    week = Column(Integer)
+    month = Column(String)  # YYYY-MM
+    labour_hours = Column(Float, nullable=False, default=0)
+    travel_hours = Column(Float, nullable=False, default=0)
+    parts_revenue = Column(Float, nullable=False, default=0)
+    parts_cost = Column(Float, nullable=False, default=0)
+    lines = Column(JSON)  # priced part lines
+
+class TechnicianWeekRollup(Base):
+    __tablename__ = "rollup_technician_week"
+
+    technician = Column(String, primary_key=True)
+    year = Column(Integer, primary_key=True)
+    week = Column(Integer, primary_key=True)
+    workorders = Column(Integer, nullable=False, default=0)
+    labour_hours = Column(Float, nullable=False, default=0)
+    travel_hours = Column(Float, nullable=False, default=0)
+    parts_revenue = Column(Float, nullable=False, default=0)
+    parts_cost = Column(Float, nullable=False, default=0)
+
+class CustomerMonthRollup(Base):
+    __tablename__ = "rollup_customer_month"
+
+    customer = Column(String, primary_key=True)
+    month = Column(String, primary_key=True)  # YYYY-MM
+    workorders = Column(Integer, nullable=False, default=0)
+    labour_hours = Column(Float, nullable=False, default=0)
+    travel_hours = Column(Float, nullable=False, default=0)
+    parts_revenue = Column(Float, nullable=False, default=0)
+    parts_cost = Column(Float, nullable=False, default=0)
+
+class Change(Base):
+    # Append-only log behind GET /changes; the id is the offline clients' sync cursor
+    __tablename__ = "change_log"
+    __table_args__ = (
+        Index("ix_change_log_entity_id", "entity", "id"),
+        {"sqlite_autoincrement": True},  # never hand out a pruned id again
+    )
+
+    id = Column(Integer, primary_key=True)
+    entity = Column(String, nullable=False)  # workorder / part / travel
+    key = Column(String, nullable=False)     # folder name or row id; "*" for a reload
+    op = Column(String, nullable=False)      # upsert / delete / reload
+    created_at = Column(Float, nullable=False)
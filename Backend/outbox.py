@@ -0,0 +1,230 @@
+import os, time, smtplib, threading
+from email.message import EmailMessage
+from database import SessionLocal
+from models import OutboxEmail
+
+
+class EmailOutbox:
+    """Persistent email queue drained by a background thread.
+
+    Requests only insert a row. The sender keeps one SMTP connection open
+    between sends, retries failures with exponential backoff, and merges
+    pending messages for the same folder into a single digest once the
+    oldest one has waited for the coalesce window.
+    """
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._smtp = None
+        self._smtp_used_at = 0.0
+        self._pruned_at = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.last_send_ms = None
+        self.total_send_ms = 0.0
+        self.last_error = None
+        self.configure()
+
+    def configure(self):
+        self.host = os.getenv("SMTP_HOST", "smtp.gmail.com")
+        self.port = int(os.getenv("SMTP_PORT", "465"))
+        self.use_ssl = os.getenv("SMTP_SSL", "1") not in ("0", "false", "False")
+        self.user = os.getenv("EMAIL_USER")
+        self.password = os.getenv("EMAIL_PASS")
+        self.sender = os.getenv("EMAIL_FROM") or self.user
+        self.recipient = os.getenv("EMAIL_TO")
+        self.coalesce_seconds = float(os.getenv("OUTBOX_COALESCE_SECONDS", "30"))
+        self.poll_seconds = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+        self.idle_seconds = float(os.getenv("OUTBOX_IDLE_SECONDS", "60"))
+        self.max_attempts = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+        self.backoff_seconds = float(os.getenv("OUTBOX_BACKOFF_SECONDS", "10"))
+        # Sent rows are only kept for troubleshooting; 0 keeps them forever
+        self.retention_days = float(os.getenv("OUTBOX_RETENTION_DAYS", "30"))
+
+    def start(self):
+        self.configure()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        self._close()
+
+    def enqueue(self, folder_name, subject, body, files=()):
+        now = time.time()
+        db = SessionLocal()
+        try:
+            db.add(OutboxEmail(
+                folder_name=folder_name,
+                subject=subject,
+                body=body,
+                files=list(files),
+                status="pending",
+                attempts=0,
+                created_at=now,
+                next_attempt_at=now + self.coalesce_seconds,
+            ))
+            db.commit()
+        finally:
+            db.close()
+        self._wake.set()
+
+    def stats(self):
+        db = SessionLocal()
+        try:
+            depth = db.query(OutboxEmail).filter(OutboxEmail.status == "pending").count()
+        finally:
+            db.close()
+        return {
+            "depth": depth,
+            "sent": self.sent,
+            "failed": self.failed,
+            "last_send_ms": self.last_send_ms,
+            "avg_send_ms": self.total_send_ms / self.sent if self.sent else None,
+            "last_error": self.last_error,
+        }
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                delay = self.flush()
+            except Exception as e:
+                self.last_error = str(e)
+                delay = self.poll_seconds
+            if self._smtp and time.time() - self._smtp_used_at > self.idle_seconds:
+                self._close()
+            self._wake.wait(timeout=delay)
+            self._wake.clear()
+
+    def flush(self):
+        """Send every due digest; returns seconds until the next one is due."""
+        now = time.time()
+        db = SessionLocal()
+        try:
+            # At most hourly: the sender wakes every few seconds
+            if now - self._pruned_at >= 3600:
+                self.prune(db, now)
+                self._pruned_at = now
+
+            pending = (
+                db.query(OutboxEmail)
+                .filter(OutboxEmail.status == "pending")
+                .order_by(OutboxEmail.created_at)
+                .all()
+            )
+            groups = {}
+            for message in pending:
+                groups.setdefault(message.folder_name, []).append(message)
+
+            next_due = now + self.poll_seconds
+            for messages in groups.values():
+                # A folder's digest goes out once its oldest message is due
+                due = min(m.next_attempt_at for m in messages)
+                if due > now:
+                    next_due = min(next_due, due)
+                    continue
+                self._deliver(db, messages)
+            return max(next_due - time.time(), 0.05)
+        finally:
+            db.close()
+
+    def prune(self, db, now=None):
+        """Delete sent messages older than the retention window; returns how many went."""
+        if self.retention_days <= 0:
+            return 0
+        cutoff = (now or time.time()) - self.retention_days * 86400
+        deleted = (
+            db.query(OutboxEmail)
+            .filter(OutboxEmail.status == "sent", OutboxEmail.sent_at < cutoff)
+            .delete(synchronize_session=False)
+        )
+        db.commit()
+        return deleted
+
+    def _deliver(self, db, messages):
+        msg = self._compose(messages)
+        started = time.perf_counter()
+        try:
+            self._send(msg)
+        except (smtplib.SMTPException, OSError) as e:
+            self._close()
+            self.last_error = str(e)
+            attempts = max(m.attempts for m in messages) + 1
+            retry_at = time.time() + min(self.backoff_seconds * 2 ** (attempts - 1), 3600)
+            for m in messages:
+                m.attempts = attempts
+                m.last_error = str(e)
+                m.next_attempt_at = retry_at
+                if attempts >= self.max_attempts:
+                    m.status = "failed"
+            if attempts >= self.max_attempts:
+                self.failed += 1
+            db.commit()
+            return
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.last_send_ms = elapsed_ms
+        self.total_send_ms += elapsed_ms
+        self.sent += 1
+        sent_at = time.time()
+        for m in messages:
+            m.status = "sent"
+            m.sent_at = sent_at
+        db.commit()
+
+    def _compose(self, messages):
+        latest = messages[-1]
+        files = []
+        for m in messages:
+            files.extend(m.files or [])
+
+        subject = latest.subject
+        if len(messages) > 1:
+            subject = f"{subject} ({len(messages)} uploads)"
+        body = latest.body
+        if files:
+            body += "\n\nNew files:\n" + "\n".join(f"  - {name}" for name in files)
+
+        msg = EmailMessage()
+        msg["From"] = self.sender
+        msg["To"] = self.recipient
+        msg["Subject"] = subject
+        msg.set_content(body)
+        return msg
+
+    def _connect(self):
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=30)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.user and self.password:
+            smtp.login(self.user, self.password)
+        return smtp
+
+    def _send(self, msg):
+        if self._smtp is None:
+            self._smtp = self._connect()
+        try:
+            self._smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped the idle connection; reconnect once
+            self._smtp = self._connect()
+            self._smtp.send_message(msg)
+        self._smtp_used_at = time.time()
+
+    def _close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+
+outbox = EmailOutbox()
@@ -0,0 +1,384 @@
+import io, csv, re
+from operator import eq, ge, le
+from datetime import datetime
+from sqlalchemy import select, insert, update, delete, func, and_, bindparam
+from sqlalchemy.orm import Session
+from models import Part, WorkOrder, WorkOrderContribution, TechnicianWeekRollup, CustomerMonthRollup
+
+MEASURES = ("labour_hours", "travel_hours", "parts_revenue", "parts_cost")
+DELTAS = ("workorders",) + MEASURES
+KEY_COLUMNS = ("technician", "customer", "year", "week", "month")
+
+# Rollup table -> the contribution columns that key it
+ROLLUPS = {
+    TechnicianWeekRollup: ("technician", "year", "week"),
+    CustomerMonthRollup: ("customer", "month"),
+}
+
+_TIME_FORMATS = ("%I:%M %p", "%I:%M:%S %p", "%H:%M", "%H:%M:%S")
+
+
+def _hours_between(in_time, out_time):
+    """Hours from the app's "7:30 AM" style inTime/outTime; a shift past midnight wraps."""
+    def parse(value):
+        # iOS formats times with a narrow no-break space before AM/PM
+        value = re.sub(r"\s+", " ", str(value or "")).strip().upper()
+        for fmt in _TIME_FORMATS:
+            try:
+                return datetime.strptime(value, fmt)
+            except ValueError:
+                pass
+        return None
+
+    start, end = parse(in_time), parse(out_time)
+    if start is None or end is None:
+        return 0.0
+    minutes = (end - start).total_seconds() / 60
+    if minutes < 0:
+        minutes += 24 * 60
+    return round(minutes / 60, 4)
+
+
+def _number(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _normalize_name(name):
+    return " ".join(str(name or "").split()).lower()
+
+
+def load_prices(db: Session, names=None):
+    """{normalised part name: (part_number, unit_price, unit_cost)} from the Part table.
+
+    Duplicate names resolve to the lowest part_id, matching what autocomplete shows first.
+    """
+    query = select(Part.part_name, Part.part_number, Part.unit_price, Part.unit_cost).order_by(Part.part_id.desc())
+    if names is not None:
+        if not names:
+            return {}
+        query = query.where(func.lower(Part.part_name).in_(names))
+    return {_normalize_name(name): (number, price, cost) for name, number, price, cost in db.execute(query)}
+
+
+def price_lines(db: Session, parts, prices=None):
+    """Price a work order's parts against the catalogue; unknown parts keep the typed unit_price."""
+    parts = [p for p in parts or [] if isinstance(p, dict) and _normalize_name(p.get("name"))]
+    if prices is None:
+        prices = load_prices(db, {_normalize_name(p["name"]) for p in parts})
+
+    lines = []
+    for part in parts:
+        quantity = _number(part.get("quantity"))
+        match = prices.get(_normalize_name(part["name"]))
+        if match is not None and match[1] is not None:
+            part_number, unit_price, unit_cost = match
+            source = "catalogue"
+        else:
+            part_number, unit_price, unit_cost = None, _number(part.get("unit_price")), None
+            source = "workorder"
+        lines.append({
+            "name": part["name"],
+            "part_number": part_number,
+            "quantity": quantity,
+            "unit_price": unit_price,
+            "unit_cost": unit_cost,
+            "revenue": round(quantity * unit_price, 2),
+            "cost": round(quantity * (unit_cost or 0), 2),
+            "source": source,
+        })
+    return lines
+
+
+def _iso_week(day):
+    # ISO year and week together: 29 Dec 2025 is week 1 of 2026, and the app's own week counter
+    # (kept on the catalog row) restarts on a different day, so neither pairs with day.year
+    return tuple(day.isocalendar()[:2]) if day else (None, None)
+
+
+def contribution(db: Session, workorder: WorkOrder, prices=None):
+    data = workorder.data or {}
+    lines = price_lines(db, data.get("parts"), prices)
+    day = workorder.date
+    year, week = _iso_week(day)
+    return {
+        "folder_name": workorder.folder_name,
+        "technician": workorder.technician or "",
+        "customer": workorder.customer or "",
+        "date": day,
+        "year": year,
+        "week": week,
+        "month": day.strftime("%Y-%m") if day else None,
+        "labour_hours": _hours_between(data.get("inTime"), data.get("outTime")),
+        "travel_hours": _number(data.get("travelHours") or data.get("travel_hours")),
+        "parts_revenue": round(sum(line["revenue"] for line in lines), 2),
+        "parts_cost": round(sum(line["cost"] for line in lines), 2),
+        "lines": lines,
+    }
+
+
+_statements = {}
+
+
+def _statements_for(dialect, model):
+    """Parameterised delta statements for one rollup table, built once so SQLAlchemy can cache them."""
+    cached = _statements.get((dialect, model))
+    if cached is None:
+        table = model.__table__
+        key = ROLLUPS[model]
+        params = {name: bindparam(name) for name in key + DELTAS}
+        matches = and_(*(table.c[name] == bindparam(f"key_{name}") for name in key))
+        cached = {
+            "upsert": None,
+            "insert": insert(table).values(params),
+            "update": update(table).where(matches).values({name: table.c[name] + bindparam(f"delta_{name}") for name in DELTAS}),
+            "prune": delete(table).where(matches, table.c.workorders <= 0),
+        }
+        if dialect in ("postgresql", "sqlite"):
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            statement = dialect_insert(table).values(params)
+            cached["upsert"] = statement.on_conflict_do_update(
+                index_elements=list(key), set_={name: table.c[name] + statement.excluded[name] for name in DELTAS},
+            )
+        _statements[(dialect, model)] = cached
+    return cached
+
+
+def _accumulate(totals, values, sign):
+    for model, columns in ROLLUPS.items():
+        key = tuple(values[name] for name in columns)
+        if any(value is None for value in key):
+            continue
+        row = totals.setdefault((model, key), dict.fromkeys(DELTAS, 0))
+        row["workorders"] += sign
+        for name in MEASURES:
+            row[name] += sign * (values[name] or 0)
+
+
+def _write(db: Session, totals):
+    """Add net deltas to the rollup rows in SQL (upsert), so concurrent saves can't lose updates."""
+    dialect = db.get_bind().dialect.name
+    for model, columns in ROLLUPS.items():
+        rows = [
+            dict(zip(columns, key), **deltas)
+            for (target, key), deltas in totals.items()
+            if target is model and any(deltas.values())
+        ]
+        if not rows:
+            continue
+        statements = _statements_for(dialect, model)
+        if statements["upsert"] is not None:
+            db.execute(statements["upsert"], rows)
+        else:
+            for row in rows:
+                params = {f"key_{name}": row[name] for name in columns}
+                params.update({f"delta_{name}": row[name] for name in DELTAS})
+                if not db.execute(statements["update"], params).rowcount:
+                    db.execute(statements["insert"], row)
+        shrunk = [{f"key_{name}": row[name] for name in columns} for row in rows if row["workorders"] < 0]
+        if shrunk:
+            db.execute(statements["prune"], shrunk)
+
+
+def _retract(db: Session, folder_names, totals):
+    """Subtract and delete the stored contributions of these work orders."""
+    columns = [getattr(WorkOrderContribution, name) for name in ("folder_name",) + KEY_COLUMNS + MEASURES]
+    for start in range(0, len(folder_names), 500):
+        chunk = WorkOrderContribution.folder_name.in_(folder_names[start:start + 500])
+        previous = db.execute(select(*columns).where(chunk)).mappings().all()
+        if previous:
+            for values in previous:
+                _accumulate(totals, values, -1)
+            db.execute(delete(WorkOrderContribution).where(chunk))
+
+
+def apply_workorders(db: Session, workorders, prices=None):
+    """Swap each work order's previous contribution for its current one (caller commits).
+
+    Deltas are netted per rollup row first, so a catalog sync of thousands of orders costs
+    one upsert per technician-week / customer-month rather than several per order.
+    """
+    workorders = list(workorders)
+    if not workorders:
+        return
+    if prices is None:
+        names = {
+            _normalize_name(part.get("name"))
+            for workorder in workorders
+            for part in (workorder.data or {}).get("parts") or []
+            if isinstance(part, dict)
+        }
+        prices = load_prices(db, names - {""})
+
+    totals = {}
+    _retract(db, [workorder.folder_name for workorder in workorders], totals)
+    rows = [contribution(db, workorder, prices) for workorder in workorders]
+    for values in rows:
+        _accumulate(totals, values, 1)
+    db.execute(insert(WorkOrderContribution), rows)
+    _write(db, totals)
+
+
+def apply_workorder(db: Session, workorder: WorkOrder, prices=None):
+    apply_workorders(db, [workorder], prices)
+
+
+def remove_workorders(db: Session, folder_names):
+    totals = {}
+    _retract(db, list(folder_names), totals)
+    _write(db, totals)
+
+
+def remove_workorder(db: Session, folder_name):
+    remove_workorders(db, [folder_name])
+
+
+def backfill(db: Session, rebuild=False, batch_size=500):
+    """Compute contributions for catalogued work orders that have none (all of them with rebuild).
+
+    Works through the catalog in keyset pages, committing each, so memory stays flat.
+    """
+    if rebuild:
+        for model in (WorkOrderContribution, *ROLLUPS):
+            db.execute(delete(model))
+        db.commit()
+    else:
+        # Contributions stored under a calendar year or the app's week number are retracted,
+        # so the pages below file them again under the ISO week
+        columns = (WorkOrderContribution.folder_name, WorkOrderContribution.date,
+                   WorkOrderContribution.year, WorkOrderContribution.week)
+        stale = [name for name, day, year, week in db.execute(select(*columns)) if (year, week) != _iso_week(day)]
+        if stale:
+            remove_workorders(db, stale)
+            db.commit()
+
+    prices, count, last = None, 0, ""
+    while True:
+        page = db.scalars(
+            select(WorkOrder)
+            .outerjoin(WorkOrderContribution, WorkOrderContribution.folder_name == WorkOrder.folder_name)
+            .where(WorkOrderContribution.folder_name.is_(None), WorkOrder.folder_name > last)
+            .order_by(WorkOrder.folder_name)
+            .limit(batch_size)
+        ).all()
+        if not page:
+            return count
+        if prices is None:
+            prices = load_prices(db)
+        last = page[-1].folder_name
+        apply_workorders(db, page, prices)
+        db.commit()
+        db.expunge_all()
+        count += len(page)
+
+
+def _filtered(model, filters, columns=None):
+    query = select(*(getattr(model, name) for name in columns)) if columns else select(model)
+    for column, op, value in filters:
+        if value is not None:
+            query = query.where(op(getattr(model, column), value))
+    return query
+
+
+def _row(row, columns):
+    item = {name: getattr(row, name) for name in columns}
+    for name in MEASURES:
+        item[name] = round(item[name], 2)
+    return item
+
+
+def _report(db: Session, model, columns, filters, order_by):
+    rows = db.scalars(_filtered(model, filters).order_by(*order_by)).all()
+    columns = columns + ("workorders",) + MEASURES
+    items = [_row(row, columns) for row in rows]
+    totals = {"workorders": sum(item["workorders"] for item in items)}
+    for name in MEASURES:
+        totals[name] = round(sum(item[name] for item in items), 2)
+    return {"rows": items, "totals": totals}
+
+
+def technician_weeks(db: Session, technician=None, year=None, week_from=None, week_to=None):
+    return _report(
+        db, TechnicianWeekRollup, ("technician", "year", "week"),
+        [("technician", eq, technician), ("year", eq, year), ("week", ge, week_from), ("week", le, week_to)],
+        (TechnicianWeekRollup.year.desc(), TechnicianWeekRollup.week.desc(), TechnicianWeekRollup.technician),
+    )
+
+
+def customer_months(db: Session, customer=None, month_from=None, month_to=None):
+    return _report(
+        db, CustomerMonthRollup, ("customer", "month"),
+        [("customer", eq, customer), ("month", ge, month_from), ("month", le, month_to)],
+        (CustomerMonthRollup.month.desc(), CustomerMonthRollup.customer),
+    )
+
+
+# Streaming exports: rows are pulled from the database in batches and written out as they go
+
+TIMESHEET_COLUMNS = ("technician", "date", "week", "folder_name", "customer", "labour_hours", "travel_hours")
+BILLING_COLUMNS = (
+    "customer", "date", "folder_name", "technician", "part_name", "part_number",
+    "quantity", "unit_price", "line_total", "price_source",
+)
+
+
+def _stream_csv(session_factory, header, query, to_rows, batch_size=500):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    db = session_factory()
+    try:
+        # Plain column rows rather than ORM objects: nothing to track, nothing to hold on to
+        for row in db.execute(query.execution_options(yield_per=batch_size)):
+            writer.writerows(to_rows(row))
+            if buffer.tell() >= 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    finally:
+        db.close()
+
+
+def _date_filters(date_from, date_to):
+    return [("date", ge, date_from), ("date", le, date_to)]
+
+
+def timesheet_csv(session_factory, technician=None, date_from=None, date_to=None):
+    """One line per work order: hours on site and travel, ordered by technician and date."""
+    query = _filtered(
+        WorkOrderContribution, [("technician", eq, technician)] + _date_filters(date_from, date_to),
+        ("technician", "date", "week", "folder_name", "customer", "labour_hours", "travel_hours"),
+    ).order_by(WorkOrderContribution.technician, WorkOrderContribution.date, WorkOrderContribution.folder_name)
+
+    def to_rows(row):
+        return [(row.technician, row.date, row.week, row.folder_name, row.customer,
+                 round(row.labour_hours, 2), round(row.travel_hours, 2))]
+
+    return _stream_csv(session_factory, TIMESHEET_COLUMNS, query, to_rows)
+
+
+def billing_csv(session_factory, customer=None, date_from=None, date_to=None):
+    """One line per billed part, plus a travel line per work order, ordered by customer and date."""
+    query = _filtered(
+        WorkOrderContribution, [("customer", eq, customer)] + _date_filters(date_from, date_to),
+        ("customer", "date", "folder_name", "technician", "travel_hours", "lines"),
+    ).order_by(WorkOrderContribution.customer, WorkOrderContribution.date, WorkOrderContribution.folder_name)
+
+    def to_rows(row):
+        prefix = (row.customer, row.date, row.folder_name, row.technician)
+        rows = [
+            prefix + (line["name"], line["part_number"] or "", line["quantity"], line["unit_price"],
+                      line["revenue"], line["source"])
+            for line in row.lines or []
+        ]
+        if row.travel_hours:
+            rows.append(prefix + ("Travel (hours)", "", round(row.travel_hours, 2), "", "", "workorder"))
+        return rows
+
+    return _stream_csv(session_factory, BILLING_COLUMNS, query, to_rows)
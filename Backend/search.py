@@ -0,0 +1,709 @@
+"""Full-text search over work-order documents.
+
+An inverted index in memory (BM25 ranking, prefix and typo-tolerant matching) that the catalog
+keeps current on every save and delete. It is saved to SEARCH_INDEX_PATH on shutdown, so a
+restart only re-indexes the work orders whose JSON changed meanwhile. To rebuild it from the
+catalog (which mirrors the JSON files on disk), with the server stopped:
+
+    python search.py rebuild
+
+or, while it runs, POST /admin/search/rebuild.
+"""
+import os, re, sys, math, time, pickle, logging, argparse, threading, unicodedata
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date
+from functools import reduce
+from heapq import heappush, heapreplace, merge, nlargest
+from operator import and_, or_
+from sqlalchemy import select
+from models import WorkOrder
+
+logger = logging.getLogger("workorder.search")
+
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", "search_index.pickle")
+
+# Per-occurrence weight of a token by the field it came from (snake_case for older documents)
+FIELD_WEIGHTS = {
+    "workOrderNumber": 3.0, "work_order_number": 3.0,
+    "purchaseOrderNumber": 3.0, "po_number": 3.0,
+    "customer": 3.0,
+    "siteAddress": 2.0, "site_address": 2.0,
+    "siteContact": 2.0, "site_contact": 2.0,
+    "parts": 1.5,
+    "jobDescription": 1.0, "job_description": 1.0,
+    "workPerformed": 1.0, "work_performed": 1.0,
+    "technician": 1.0,
+    "travelLocation": 1.0,
+    "phoneNumber": 1.0,
+}
+DEFAULT_WEIGHT = 0.5
+# Times, flags and numbers that would only add noise
+SKIP_FIELDS = {"date", "inTime", "outTime", "travelHours", "week", "weekNumber", "orientation", "hotWorkPermit"}
+PART_FIELDS = ("name", "part_name", "part_number", "description")
+
+MAX_QUERY_TOKENS = 8
+PREFIX_MIN_LENGTH = 2
+PREFIX_EXPANSIONS = 20
+FUZZY_MIN_LENGTH = 4
+FUZZY_CANDIDATES = 200
+# Terms in at least this many work orders keep a ready-made doc bitmap
+BITMAP_MIN_DF = 1024
+# Result sets up to this size are scored outright rather than walked in impact order
+DIRECT_SCORE_LIMIT = 2000
+# Up to this many expanded query terms, a document's term list is bisected rather than scanned
+BISECT_TERMS = 16
+
+_TOKEN = re.compile(r"[^\W_]+")
+_TF_SCALE = 4  # term frequencies are stored as fixed point, tf * 4, in the low 16 bits
+_MAX_IMPACT = 0xFFFF
+_DOC_MASK = 0xFFFFFFFF
+
+
+def _fold(text):
+    # Lower-case and strip accents, so "Café" and "cafe" are the same token
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def tokenize(text):
+    return _TOKEN.findall(_fold(text))
+
+
+def _grams(term):
+    padded = f"^{term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _distance(a, b, limit):
+    """Edit distance counting a transposition as one edit; anything over limit returns limit + 1."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def _fields(data):
+    """(field, text) pairs of a work order that get indexed."""
+    for key, value in data.items():
+        if key in SKIP_FIELDS:
+            continue
+        if key == "parts" and isinstance(value, list):
+            text = " | ".join(
+                str(part[name]) for part in value if isinstance(part, dict) for name in PART_FIELDS if part.get(name)
+            )
+            if text:
+                yield "parts", text
+        elif isinstance(value, str):
+            if value.strip():
+                yield key, value
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and key in FIELD_WEIGHTS:
+            yield key, str(value)
+
+
+def _lower(value):
+    return str(value).strip().lower() if value else ""
+
+
+def _bits(bitmap):
+    """Set bit positions (doc ids) of an int bitmap, lowest first."""
+    text = bin(bitmap)[:1:-1]
+    i = text.find("1")
+    while i >= 0:
+        yield i
+        i = text.find("1", i + 1)
+
+
+def _bitmap(doc_ids, size):
+    bits = bytearray((size >> 3) + 1)
+    for doc in doc_ids:
+        bits[doc >> 3] |= 1 << (doc & 7)
+    return int.from_bytes(bits, "little")
+
+
+def _stream(postings, scale):
+    # (-score, doc), best first; postings are already sorted by impact
+    for packed in postings:
+        yield ((packed >> 32) - _MAX_IMPACT) * scale, packed & _DOC_MASK
+
+
+def _month(ordinal):
+    day = date.fromordinal(ordinal)
+    return day.year * 12 + day.month - 1
+
+
+class SearchIndex:
+    """Inverted index over work orders, keyed internally by small integer doc ids.
+
+    Each term's postings are one array of 64-bit ints, (max impact - impact) << 32 | doc id, so
+    they sort by BM25 impact, best first: the top results are found by walking the heads of the
+    query's lists and stopping once nothing further down can beat them. Which documents match
+    at all (every term, the technician/status/date filters, the total) is worked out on int
+    bitmaps, cached for common terms. Each document also keeps its (term id << 16 | tf) list,
+    used to score it and to take exactly its postings out again on update or delete.
+
+    Impacts use the average document length as of the last build; save() refreshes them once
+    it has drifted by more than a quarter.
+    """
+
+    VERSION = 2
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self._doc_ids = {}        # folder name -> doc id
+        self._names = []          # doc id -> folder name, None once removed
+        self._mtimes = array("d")
+        self._dates = array("i")  # date ordinal, 0 when unknown
+        self._technicians = []    # doc id -> lower-cased technician
+        self._statuses = []       # doc id -> lower-cased job status
+        self._lengths = array("f")
+        self._doc_terms = []      # doc id -> array of term id << 16 | tf
+        self._term_ids = {}       # term -> term id
+        self._terms = []          # term id -> term
+        self._postings = []       # term id -> impact-ordered array, see above
+        self._vocab = []          # sorted terms, for prefix expansion
+        self._new_terms = []      # not merged into _vocab yet
+        self._grams = {}          # trigram -> array of term ids, for typo tolerance
+        self._bitmaps = {}        # term id -> doc bitmap, for terms in BITMAP_MIN_DF+ documents
+        self._facets = {}         # ("technician" | "status" | "month", value) -> doc bitmap
+        self._pending = set()     # docs added in bulk() whose postings aren't written yet
+        self._bulk = 0
+        self._norm_length = None
+        self._live = 0
+        self._total_length = 0.0
+        self.dirty = False
+
+    def __len__(self):
+        return self._live
+
+    @property
+    def terms(self):
+        return len(self._terms)
+
+    @contextmanager
+    def bulk(self):
+        """Batch many add()/remove() calls: postings and bitmaps are written once at the end."""
+        with self._lock:
+            self._bulk += 1
+            try:
+                yield self
+            finally:
+                self._bulk -= 1
+                if not self._bulk and self._pending:
+                    if self._norm_length is None or len(self._pending) > self._live // 2:
+                        self._renormalize()
+                    else:
+                        touched = set()
+                        for doc in self._pending:
+                            touched.update(self._post(doc, append=True))
+                        for term_id in touched:
+                            self._postings[term_id] = array("Q", sorted(self._postings[term_id]))
+                    self._pending.clear()
+                    self._merge_vocab()
+                    self._rebuild_bitmaps()
+
+    def _term_id(self, term):
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            term_id = self._term_ids[term] = len(self._terms)
+            self._terms.append(term)
+            self._postings.append(array("Q"))
+            self._new_terms.append(term)
+            if len(self._new_terms) > 1000 and not self._bulk:
+                self._merge_vocab()
+            if len(term) >= 3 and not term.isdigit():
+                for gram in _grams(term):
+                    self._grams.setdefault(gram, array("I")).append(term_id)
+        return term_id
+
+    def _merge_vocab(self):
+        if self._new_terms:
+            self._vocab = sorted(self._vocab + self._new_terms)
+            self._new_terms = []
+
+    def _entries(self, doc):
+        """(term id, posting) for each term of a doc, with impacts at the current norm length."""
+        norm = self.K1 * (1 - self.B + self.B * self._lengths[doc] / self._norm_length)
+        for packed in self._doc_terms[doc]:
+            tf = (packed & 0xFFFF) / _TF_SCALE
+            impact = math.ceil(_MAX_IMPACT * tf / (tf + norm))
+            yield packed >> 16, (_MAX_IMPACT - impact) << 32 | doc
+
+    def _post(self, doc, append=False):
+        touched = []
+        for term_id, posting in self._entries(doc):
+            if append:
+                self._postings[term_id].append(posting)
+            else:
+                insort(self._postings[term_id], posting)
+            touched.append(term_id)
+        return touched
+
+    def _renormalize(self):
+        # Recompute every impact against today's average length and rewrite all postings
+        self._norm_length = max(self._total_length / self._live, 1.0) if self._live else 1.0
+        self._postings = [array("Q") for _ in self._terms]
+        for doc, terms in enumerate(self._doc_terms):
+            if terms is not None:
+                self._post(doc, append=True)
+        self._postings = [array("Q", sorted(postings)) for postings in self._postings]
+
+    def _rebuild_bitmaps(self):
+        size = len(self._names)
+        self._bitmaps = {
+            term_id: _bitmap((packed & _DOC_MASK for packed in postings), size)
+            for term_id, postings in enumerate(self._postings) if len(postings) >= BITMAP_MIN_DF
+        }
+        facets = {}
+        for doc, name in enumerate(self._names):
+            if name is not None:
+                for key in self._facet_keys(doc):
+                    facets.setdefault(key, []).append(doc)
+        self._facets = {key: _bitmap(docs, size) for key, docs in facets.items()}
+
+    def _facet_keys(self, doc):
+        if self._technicians[doc]:
+            yield "technician", self._technicians[doc]
+        if self._statuses[doc]:
+            yield "status", self._statuses[doc]
+        if self._dates[doc]:
+            yield "month", _month(self._dates[doc])
+
+    def add(self, folder_name, data, mtime=0.0, day=None, technician=None, status=None):
+        """Index (or re-index) one work order."""
+        counts = Counter()
+        for field, text in _fields(data or {}):
+            weight = FIELD_WEIGHTS.get(field, DEFAULT_WEIGHT)
+            for token in tokenize(text):
+                counts[token] += weight
+
+        with self._lock:
+            self._remove(folder_name)
+            doc = self._doc_ids.get(folder_name)
+            if doc is None:
+                doc = self._doc_ids[folder_name] = len(self._names)
+                self._names.append(None)
+                self._mtimes.append(0.0)
+                self._dates.append(0)
+                self._technicians.append("")
+                self._statuses.append("")
+                self._lengths.append(0.0)
+                self._doc_terms.append(None)
+
+            # Sorted by term id, so score() can bisect for a handful of query terms
+            terms = array("Q", sorted(
+                self._term_id(token) << 16 | min(max(int(tf * _TF_SCALE + 0.5), 1), 0xFFFF)
+                for token, tf in counts.items()
+            ))
+            length = sum(counts.values())
+            self._names[doc] = folder_name
+            self._mtimes[doc] = mtime or 0.0
+            self._dates[doc] = day.toordinal() if day else 0
+            self._technicians[doc] = _lower(technician)
+            self._statuses[doc] = _lower(status)
+            self._lengths[doc] = length
+            self._doc_terms[doc] = terms
+            self._live += 1
+            self._total_length += length
+            self.dirty = True
+
+            if self._bulk:
+                self._pending.add(doc)
+                return
+            if self._norm_length is None:
+                self._norm_length = max(length, 1.0)
+            bit = 1 << doc
+            for term_id in self._post(doc):
+                if term_id in self._bitmaps:
+                    self._bitmaps[term_id] |= bit
+                elif len(self._postings[term_id]) >= BITMAP_MIN_DF:
+                    self._bitmaps[term_id] = _bitmap((p & _DOC_MASK for p in self._postings[term_id]), len(self._names))
+            for key in self._facet_keys(doc):
+                self._facets[key] = self._facets.get(key, 0) | bit
+
+    def remove(self, folder_name):
+        with self._lock:
+            self._remove(folder_name)
+
+    def _remove(self, folder_name):
+        doc = self._doc_ids.get(folder_name)
+        if doc is None or self._names[doc] is None:
+            return
+        if doc in self._pending:
+            self._pending.discard(doc)
+        else:
+            keep = ~(1 << doc)
+            for term_id, posting in self._entries(doc):
+                postings = self._postings[term_id]
+                i = bisect_left(postings, posting)
+                if i < len(postings) and postings[i] == posting:
+                    del postings[i]
+                if term_id in self._bitmaps:
+                    self._bitmaps[term_id] &= keep
+            for key in self._facet_keys(doc):
+                if key in self._facets:
+                    self._facets[key] &= keep
+        self._total_length -= self._lengths[doc]
+        self._live -= 1
+        self._names[doc] = None
+        self._doc_terms[doc] = None
+        self.dirty = True
+
+    # Query side
+
+    def _expand(self, token):
+        """Index terms a query token stands for, with a weight: exact 1.0, prefix and typo less."""
+        postings = self._postings
+        expansions = {}
+        exact = self._term_ids.get(token)
+        if exact is not None and postings[exact]:
+            expansions[exact] = 1.0
+
+        if len(token) >= PREFIX_MIN_LENGTH:
+            candidates = [term_id for term_id in self._prefixed(token, 50 * PREFIX_EXPANSIONS) if term_id != exact and postings[term_id]]
+            for term_id in nlargest(PREFIX_EXPANSIONS, candidates, key=lambda t: len(postings[t])):
+                # A prefix that covers more of the word counts for more
+                expansions[term_id] = 0.4 + 0.4 * len(token) / len(self._terms[term_id])
+
+        if len(token) >= FUZZY_MIN_LENGTH and not token.isdigit():
+            limit = 1 if len(token) <= 7 else 2
+            grams = _grams(token)
+            shared = Counter()
+            for gram in grams:
+                ids = self._grams.get(gram)
+                if ids:
+                    shared.update(ids)
+            # One edit touches up to three trigrams, a transposition four
+            need = max(1, len(grams) - 4 * limit)
+            candidates = [term_id for term_id, count in shared.items() if count >= need]
+            if len(token) <= 5:
+                # Swapping the middle letters of a short word ("pmup") breaks every trigram it has;
+                # such a typo keeps the first letter and one of the next two, so look there as well
+                lengths = range(len(token) - limit, len(token) + limit + 1)
+                for prefix in {token[:2], token[0] + token[2]}:
+                    candidates.extend(self._prefixed(prefix, FUZZY_CANDIDATES, lengths))
+            checked = 0
+            for term_id in candidates:
+                if term_id in expansions or not postings[term_id]:
+                    continue
+                term = self._terms[term_id]
+                if abs(len(term) - len(token)) > limit:
+                    continue
+                distance = _distance(token, term, limit)
+                if distance <= limit:
+                    expansions[term_id] = 0.6 if distance == 1 else 0.4
+                checked += 1
+                if checked >= FUZZY_CANDIDATES:
+                    break
+        return expansions
+
+    def _prefixed(self, prefix, limit, lengths=None):
+        """Ids of up to limit terms starting with prefix (plus any not merged into _vocab yet),
+        only counting terms whose length is in lengths when given."""
+        vocab = self._vocab
+        found = [
+            self._term_ids[term] for term in self._new_terms
+            if term.startswith(prefix) and (lengths is None or len(term) in lengths)
+        ]
+        i = bisect_left(vocab, prefix)
+        while i < len(vocab) and vocab[i].startswith(prefix) and len(found) < limit:
+            if lengths is None or len(vocab[i]) in lengths:
+                found.append(self._term_ids[vocab[i]])
+            i += 1
+        return found
+
+    def _term_bitmap(self, term_id):
+        bitmap = self._bitmaps.get(term_id)
+        if bitmap is None:
+            bitmap = _bitmap((packed & _DOC_MASK for packed in self._postings[term_id]), len(self._names))
+        return bitmap
+
+    def _filter(self, technician, status, low, high):
+        """Bitmap of the docs passing the filters, or None when there are none."""
+        facets = self._facets
+        bitmap = None
+        if technician:
+            bitmap = facets.get(("technician", technician), 0)
+        if status:
+            found = facets.get(("status", status), 0)
+            bitmap = found if bitmap is None else bitmap & found
+        if low or high:
+            first = _month(low) if low else -1
+            last = _month(high) if high else 1 << 30
+            dated = 0
+            for (kind, month), docs in facets.items():
+                if kind != "month" or not first <= month <= last:
+                    continue
+                if first < month < last:
+                    dated |= docs
+                    continue
+                # A partial month at either end: check those docs' dates one by one
+                edge = docs if bitmap is None else docs & bitmap
+                dated |= _bitmap(
+                    (doc for doc in _bits(edge)
+                     if (not low or self._dates[doc] >= low) and (not high or self._dates[doc] <= high)),
+                    len(self._names),
+                )
+            bitmap = dated if bitmap is None else bitmap & dated
+        return bitmap
+
+    def search(self, query, technician=None, status=None, date_from=None, date_to=None, limit=20, offset=0):
+        """Returns (total, [(folder name, score)], matched terms) for a free-text query.
+
+        Every token has to match (exactly, as a prefix or within a typo or two); when no work
+        order has them all, the best partial matches are returned instead.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TOKENS]
+        low = date_from.toordinal() if date_from else None
+        high = date_to.toordinal() if date_to else None
+
+        with self._lock:
+            if not tokens or not self._live:
+                return 0, [], set()
+            n = self._live
+            k1 = self.K1
+            expansions = [self._expand(token) for token in tokens]
+            matched = {self._terms[term_id] for terms in expansions for term_id in terms}
+
+            token_bitmaps = []
+            for terms in expansions:
+                bitmap = 0
+                for term_id in terms:
+                    bitmap |= self._term_bitmap(term_id)
+                token_bitmaps.append(bitmap)
+            allowed = self._filter(_lower(technician), _lower(status), low, high)
+            match = reduce(and_, token_bitmaps)
+            if not match and len(tokens) > 1:
+                match = reduce(or_, token_bitmaps)
+            if allowed is not None:
+                match &= allowed
+            total = match.bit_count()
+            if not total:
+                return 0, [], matched
+
+            # term id -> [(token position, weight * idf * (k1 + 1))]
+            scales = {}
+            for position, terms in enumerate(expansions):
+                for term_id, weight in terms.items():
+                    df = len(self._postings[term_id])
+                    idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                    scales.setdefault(term_id, []).append((position, weight * idf * (k1 + 1)))
+
+            lengths, doc_terms, dates = self._lengths, self._doc_terms, self._dates
+            norm_length, b = self._norm_length, self.B
+
+            if len(scales) <= BISECT_TERMS:
+                probes = [(term_id << 16, term_id << 16 | 0xFFFF, hits) for term_id, hits in scales.items()]
+
+                def entries(terms):
+                    for start, end, hits in probes:
+                        i = bisect_left(terms, start)
+                        if i < len(terms) and terms[i] <= end:
+                            yield terms[i], hits
+            else:
+                def entries(terms):
+                    for packed in terms:
+                        hits = scales.get(packed >> 16)
+                        if hits:
+                            yield packed, hits
+
+            def score(doc):
+                norm = k1 * (1 - b + b * lengths[doc] / norm_length)
+                best = [0.0] * len(tokens)
+                for packed, hits in entries(doc_terms[doc]):
+                    tf = (packed & 0xFFFF) / _TF_SCALE
+                    saturation = tf / (tf + norm)
+                    for position, scale in hits:
+                        if scale * saturation > best[position]:
+                            best[position] = scale * saturation
+                return sum(best)
+
+            wanted = offset + limit
+            if total <= DIRECT_SCORE_LIMIT:
+                top = nlargest(wanted, ((score(doc), dates[doc], doc) for doc in _bits(match)))
+            else:
+                top = self._top(expansions, scales, match, score, wanted)
+            return total, [(self._names[doc], value) for value, _, doc in top[offset:]], matched
+
+    def _top(self, expansions, scales, match, score, wanted):
+        """Threshold algorithm: walk every token's postings in impact order, fully score each
+        matching doc on first sight, and stop once the best score any unseen doc could still
+        reach (the sum of the current list heads) can't make the top `wanted`."""
+        streams = []
+        for position, terms in enumerate(expansions):
+            streams.append(merge(*(
+                _stream(self._postings[term_id], scale / _MAX_IMPACT)
+                for term_id in terms for at, scale in scales[term_id] if at == position
+            )))
+        members = match.to_bytes((len(self._names) >> 3) + 1, "little")
+        dates = self._dates
+        heads = [math.inf] * len(streams)
+        top, seen = [], set()
+        while True:
+            for position, stream in enumerate(streams):
+                if heads[position] == 0:
+                    continue
+                head = next(stream, None)
+                if head is None:
+                    heads[position] = 0
+                    continue
+                heads[position] = -head[0]
+                doc = head[1]
+                if doc in seen or not members[doc >> 3] >> (doc & 7) & 1:
+                    continue
+                seen.add(doc)
+                entry = (score(doc), dates[doc], doc)
+                if len(top) < wanted:
+                    heappush(top, entry)
+                elif entry > top[0]:
+                    heapreplace(top, entry)
+            if not any(heads) or (len(top) >= wanted and top[0][0] >= sum(heads)):
+                return sorted(top, reverse=True)
+
+    # Persistence
+
+    def build(self, rows):
+        """Replace the contents with (folder name, data, mtime, date, technician, status) rows."""
+        with self._lock:
+            self._clear()
+            with self.bulk():
+                for row in rows:
+                    self.add(*row)
+            self.dirty = True
+
+    def reconcile(self, db):
+        """Bring the index in line with the catalog: re-index changed rows, drop removed ones."""
+        known = dict(db.execute(select(WorkOrder.folder_name, WorkOrder.mtime)).all())
+        with self._lock:
+            indexed = {name: self._mtimes[doc] for name, doc in self._doc_ids.items() if self._names[doc] is not None}
+        stale = [name for name, mtime in known.items() if indexed.get(name) != mtime]
+        with self.bulk():
+            for name in set(indexed) - set(known):
+                self.remove(name)
+            for start in range(0, len(stale), 500):
+                for row in db.scalars(select(WorkOrder).where(WorkOrder.folder_name.in_(stale[start:start + 500]))):
+                    self.add(row.folder_name, row.data, row.mtime, row.date, row.technician, row.status)
+                db.expunge_all()
+        return len(stale)
+
+    def rebuild(self, db):
+        columns = (WorkOrder.folder_name, WorkOrder.data, WorkOrder.mtime, WorkOrder.date, WorkOrder.technician, WorkOrder.status)
+        self.build(tuple(row) for row in db.execute(select(*columns).execution_options(yield_per=1000)))
+        return len(self)
+
+    def save(self, path=SEARCH_INDEX_PATH):
+        with self._lock:
+            if self._live and abs(self._total_length / self._live - self._norm_length) > self._norm_length / 4:
+                self._renormalize()
+            self._merge_vocab()
+            state = {name: getattr(self, name) for name in vars(self) if name.startswith("_") and name != "_lock"}
+            state["version"] = self.VERSION
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            self.dirty = False
+
+    def load(self, path=SEARCH_INDEX_PATH):
+        """Load a saved index; a missing, old or unreadable file leaves it empty for reconcile()."""
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning("Ignoring unreadable search index %s: %s", path, e)
+            return False
+        if state.pop("version", None) != self.VERSION:
+            return False
+        with self._lock:
+            self._clear()
+            for name, value in state.items():
+                setattr(self, name, value)
+        return True
+
+
+index = SearchIndex()
+
+
+def snippets(data, terms, limit=2, width=120):
+    """Up to `limit` excerpts of the best-weighted fields that contain matched terms.
+
+    Each is {"field", "text", "highlights": [[start, end], ...]} with offsets into text.
+    """
+    found = []
+    fields = sorted(_fields(data or {}), key=lambda item: -FIELD_WEIGHTS.get(item[0], DEFAULT_WEIGHT))
+    for field, text in fields:
+        if text.isascii():
+            # Lower-casing ASCII keeps offsets, so the whole field is folded in one go
+            folded = text.lower()
+            if not any(term in folded for term in terms):
+                continue
+            hits = [(m.start(), m.end()) for m in _TOKEN.finditer(folded) if m.group() in terms]
+        else:
+            hits = [(m.start(), m.end()) for m in _TOKEN.finditer(text) if _fold(m.group()) in terms]
+        if not hits:
+            continue
+        start = 0 if len(text) <= width else max(0, min(hits[0][0] - width // 3, len(text) - width))
+        end = min(len(text), start + width)
+        lead = "…" if start > 0 else ""
+        found.append({
+            "field": field,
+            "text": lead + text[start:end] + ("…" if end < len(text) else ""),
+            "highlights": [[s - start + len(lead), e - start + len(lead)] for s, e in hits if s >= start and e <= end],
+        })
+        if len(found) >= limit:
+            break
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild or inspect the work-order search index.")
+    parser.add_argument("command", choices=["rebuild", "stats"])
+    parser.add_argument("--media-root", default=os.getenv("MEDIA_ROOT", "media"))
+    parser.add_argument("--path", default=SEARCH_INDEX_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "stats":
+        if not index.load(args.path):
+            print("No usable index at", args.path)
+            return 1
+        print(f"{len(index)} work orders, {index.terms} terms")
+        return 0
+
+    import catalog
+    from database import SessionLocal
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        # Pick up JSON edited on disk first; the index is then built from the catalog rows
+        catalog.sync_catalog(db, args.media_root)
+        count = index.rebuild(db)
+    finally:
+        db.close()
+    index.save(args.path)
+    print(f"Indexed {count} work orders in {time.perf_counter() - started:.1f}s -> {args.path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import os, json, time, shutil, hashlib, logging, threading, subprocess, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import metrics
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it only video posters are produced
+    Image = None
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".heic", ".webp", ".gif")
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".m4v", ".avi", ".webm")
+
+DERIVATIVES_DIRNAME = ".derivatives"
+MANIFEST_NAME = "manifest.json"
+SIZES = {"thumb": 320, "preview": 1280}
+WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+# A failed original (Pillow missing, ffmpeg hiccup, file still being written) is tried again after this
+RETRY_SECONDS = int(os.getenv("THUMBNAIL_RETRY_SECONDS", "600"))
+
+logger = logging.getLogger(__name__)
+
+
+def _content_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _save_sizes(image, out_dir, key):
+    image = ImageOps.exif_transpose(image).convert("RGB")
+    names = {}
+    for kind, edge in sorted(SIZES.items(), key=lambda item: -item[1]):
+        image.thumbnail((edge, edge))
+        name = f"{key}_{kind}.jpg"
+        tmp_path = os.path.join(out_dir, f".{name}.tmp")
+        image.save(tmp_path, "JPEG", quality=80, optimize=True)
+        os.replace(tmp_path, os.path.join(out_dir, name))
+        names[kind] = name
+    return names
+
+
+def _video_poster(src_path, out_dir, key):
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg not installed")
+    poster = os.path.join(out_dir, f".{key}_poster.jpg")
+    subprocess.run(
+        [ffmpeg, "-y", "-loglevel", "error", "-ss", "1", "-i", src_path, "-frames:v", "1", poster],
+        check=True, timeout=120,
+    )
+    try:
+        if Image is None:
+            name = f"{key}_thumb.jpg"
+            os.replace(poster, os.path.join(out_dir, name))
+            return {"thumb": name, "preview": name}
+        with Image.open(poster) as image:
+            return _save_sizes(image, out_dir, key)
+    finally:
+        if os.path.exists(poster):
+            os.remove(poster)
+
+
+def render(src_path, out_dir):
+    """Worker entry point: build (or reuse) the derivatives for one original file."""
+    os.makedirs(out_dir, exist_ok=True)
+    stat = os.stat(src_path)
+    key = _content_hash(src_path)
+    entry = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": key}
+
+    existing = {kind: f"{key}_{kind}.jpg" for kind in SIZES}
+    if all(os.path.exists(os.path.join(out_dir, name)) for name in existing.values()):
+        return dict(entry, **existing)
+
+    try:
+        if src_path.lower().endswith(VIDEO_EXTENSIONS):
+            entry.update(_video_poster(src_path, out_dir, key))
+        elif Image is None:
+            raise RuntimeError("Pillow not installed")
+        else:
+            with Image.open(src_path) as image:
+                entry.update(_save_sizes(image, out_dir, key))
+    except Exception as e:
+        entry["error"] = str(e)
+        entry["retry_at"] = time.time() + RETRY_SECONDS
+    return entry
+
+
+def _lower_priority():
+    # Keep thumbnail work from competing with request handling on the Pi
+    try:
+        os.nice(10)
+    except OSError:
+        pass
+
+
+class DerivativePipeline:
+    """Generates thumbnails/previews in a bounded process pool and records them per folder.
+
+    Derivatives live in <folder>/.derivatives/ named by the original's content hash; a
+    manifest maps each original filename to its derivatives so the album never rehashes.
+    """
+
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = set()
+
+    def start(self):
+        if self.workers > 0 and self._executor is None:
+            # Not fork: the workers would inherit the server's threads, locks and open sockets
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(method),
+                initializer=_lower_priority,
+            )
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @staticmethod
+    def wants(filename):
+        return filename.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS)
+
+    def schedule(self, folder_path, filenames):
+        if self._executor is None:
+            return
+        out_dir = os.path.join(folder_path, DERIVATIVES_DIRNAME)
+        for filename in filenames:
+            job = (folder_path, filename)
+            with self._lock:
+                if not self.wants(filename) or job in self._pending:
+                    continue
+                self._pending.add(job)
+            future = self._executor.submit(render, os.path.join(folder_path, filename), out_dir)
+            future.add_done_callback(lambda f, job=job: self._finished(job, f))
+
+    def lookup(self, folder_path, filenames):
+        """Return {filename: entry} for originals whose derivatives are current.
+
+        Originals that are missing or stale are scheduled, so an album view backfills
+        folders that were uploaded before the pipeline existed. Failures are retried once
+        their retry_at has passed.
+        """
+        manifest = self._read_manifest(folder_path)
+        now = time.time()
+        ready, missing = {}, []
+        for filename in filenames:
+            entry = manifest.get(filename)
+            try:
+                stat = os.stat(os.path.join(folder_path, filename))
+            except FileNotFoundError:
+                continue
+            if (entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime
+                    and ("error" not in entry or entry.get("retry_at", 0) > now)):
+                ready[filename] = entry
+            else:
+                missing.append(filename)
+        self.schedule(folder_path, missing)
+        return ready
+
+    def _finished(self, job, future):
+        folder_path, filename = job
+        try:
+            entry = future.result()
+        except Exception as e:
+            entry = None
+            logger.error("Derivative job failed for %s/%s: %s", folder_path, filename, e)
+        with self._lock:
+            self._pending.discard(job)
+            if entry is not None and os.path.isdir(folder_path):
+                manifest = self._read_manifest(folder_path)
+                manifest[filename] = entry
+                self._write_manifest(folder_path, manifest)
+
+    @staticmethod
+    def _read_manifest(folder_path):
+        try:
+            with open(os.path.join(folder_path, DERIVATIVES_DIRNAME, MANIFEST_NAME), "rb") as f:
+                body = f.read()
+            metrics.fs_read(len(body))
+            return json.loads(body)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    @staticmethod
+    def _write_manifest(folder_path, manifest):
+        out_dir = os.path.join(folder_path, DERIVATIVES_DIRNAME)
+        os.makedirs(out_dir, exist_ok=True)
+        tmp_path = os.path.join(out_dir, f".{MANIFEST_NAME}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(out_dir, MANIFEST_NAME))
+
+
+derivatives = DerivativePipeline()
@@ -0,0 +1,207 @@
+import os, json, time, uuid, asyncio
+import aiofiles
+import aiofiles.os
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+import metrics
+
+CHUNK_SIZE = 1024 * 1024
+MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", str(500 * 1024 * 1024)))
+MAX_REQUEST_BYTES = int(os.getenv("UPLOAD_MAX_REQUEST_BYTES", str(1024 * 1024 * 1024)))
+STALE_UPLOAD_SECONDS = int(os.getenv("UPLOAD_STALE_HOURS", "48")) * 3600
+
+# Resumable uploads are staged inside the media root so the final rename stays on one filesystem
+STAGING_DIRNAME = ".uploads"
+
+_locks = {}
+
+
+def safe_filename(filename):
+    name = os.path.basename((filename or "").replace("\\", "/"))
+    if name in ("", ".", "..") or name.startswith("."):
+        raise HTTPException(status_code=400, detail=f"Invalid filename: {filename!r}")
+    return name
+
+
+async def save_upload(upload: UploadFile, dest_path, max_bytes=MAX_FILE_BYTES):
+    """Stream an uploaded file to dest_path in fixed-size chunks via temp file + atomic rename."""
+    tmp_path = f"{dest_path}.{uuid.uuid4().hex}.part"
+    written = await _stream_to(upload, tmp_path, max_bytes)
+    try:
+        await aiofiles.os.replace(tmp_path, dest_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            await aiofiles.os.remove(tmp_path)
+        raise
+    return written
+
+
+async def stage_upload(media_root, upload: UploadFile, max_bytes=MAX_FILE_BYTES):
+    """Stream an uploaded file into the staging area and return its path; the caller renames it
+    into place (same filesystem) or deletes it. Leftovers are swept by purge_stale_uploads."""
+    tmp_path = os.path.join(_staging_dir(media_root), f"{uuid.uuid4().hex}.part")
+    await _stream_to(upload, tmp_path, max_bytes)
+    return tmp_path
+
+
+async def _stream_to(upload: UploadFile, tmp_path, max_bytes):
+    written = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out:
+            while chunk := await upload.read(CHUNK_SIZE):
+                written += len(chunk)
+                if written > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"{upload.filename} exceeds {max_bytes} bytes")
+                await out.write(chunk)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            await aiofiles.os.remove(tmp_path)
+        raise
+    finally:
+        metrics.fs_written(written)
+    return written
+
+
+def _staging_dir(media_root):
+    path = os.path.join(media_root, STAGING_DIRNAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _paths(media_root, upload_id):
+    try:
+        upload_id = uuid.UUID(upload_id).hex
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    staging = _staging_dir(media_root)
+    return os.path.join(staging, f"{upload_id}.json"), os.path.join(staging, f"{upload_id}.part")
+
+
+class RequestSizeLimit:
+    """Caps request bodies at MAX_REQUEST_BYTES before anything parses them.
+
+    A declared Content-Length over the cap gets 413 without the body being read; a chunked
+    body is counted as it streams in, and the read that crosses the cap raises 413.
+    """
+
+    def __init__(self, app, max_bytes=MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Uploads are limited to {self.max_bytes} bytes per request"
+        headers = dict(scope["headers"])
+        try:
+            declared = int(headers.get(b"content-length", b"0"))
+        except ValueError:
+            declared = 0
+        if declared > self.max_bytes:
+            await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def receive_counted():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, receive_counted, send)
+
+
+def _load_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+
+def init_upload(media_root, folder_name, filename, size):
+    if size < 0 or size > MAX_FILE_BYTES:
+        raise HTTPException(status_code=413, detail=f"Uploads are limited to {MAX_FILE_BYTES} bytes")
+    upload_id = uuid.uuid4().hex
+    meta_path, part_path = _paths(media_root, upload_id)
+    meta = {
+        "upload_id": upload_id,
+        "folder_name": safe_filename(folder_name),
+        "filename": safe_filename(filename),
+        "size": size,
+        "created_at": time.time(),
+    }
+    open(part_path, "wb").close()
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    return {"upload_id": upload_id, "offset": 0, "size": size, "chunk_size": CHUNK_SIZE}
+
+
+def upload_status(media_root, upload_id):
+    meta_path, part_path = _paths(media_root, upload_id)
+    meta = _load_meta(meta_path)
+    return {"upload_id": meta["upload_id"], "offset": os.path.getsize(part_path), "size": meta["size"]}
+
+
+async def put_chunk(media_root, upload_id, offset, stream):
+    """Append a request body stream at offset; offset must equal the bytes already received."""
+    meta_path, part_path = _paths(media_root, upload_id)
+    lock = _locks.setdefault(part_path, asyncio.Lock())
+    async with lock:
+        meta = _load_meta(meta_path)
+        received = os.path.getsize(part_path)
+        if offset != received:
+            raise HTTPException(status_code=409, detail={"error": "Offset mismatch", "offset": received})
+
+        async with aiofiles.open(part_path, "ab") as out:
+            async for chunk in stream:
+                received += len(chunk)
+                if received > meta["size"]:
+                    # Drop the overflowing chunk; the client can resume from the last good offset
+                    await out.truncate(received - len(chunk))
+                    raise HTTPException(status_code=413, detail="Chunk runs past the declared upload size")
+                await out.write(chunk)
+                metrics.fs_written(len(chunk))
+        return {"upload_id": meta["upload_id"], "offset": received, "size": meta["size"]}
+
+
+async def commit_upload(media_root, upload_id, folder_path_for):
+    """Move a completed upload into its work-order folder; returns (folder_name, filename)."""
+    meta_path, part_path = _paths(media_root, upload_id)
+    lock = _locks.setdefault(part_path, asyncio.Lock())
+    async with lock:
+        meta = _load_meta(meta_path)
+        received = os.path.getsize(part_path)
+        if received != meta["size"]:
+            raise HTTPException(status_code=409, detail={"error": "Upload incomplete", "offset": received})
+
+        folder_path = folder_path_for(meta["folder_name"])
+        os.makedirs(folder_path, exist_ok=True)
+        await aiofiles.os.replace(part_path, os.path.join(folder_path, meta["filename"]))
+        await aiofiles.os.remove(meta_path)
+    _locks.pop(part_path, None)
+    return meta["folder_name"], meta["filename"]
+
+
+def abort_upload(media_root, upload_id):
+    meta_path, part_path = _paths(media_root, upload_id)
+    _load_meta(meta_path)
+    for path in (part_path, meta_path):
+        if os.path.exists(path):
+            os.remove(path)
+    _locks.pop(part_path, None)
+
+
+def purge_stale_uploads(media_root):
+    cutoff = time.time() - STALE_UPLOAD_SECONDS
+    staging = _staging_dir(media_root)
+    for name in os.listdir(staging):
+        path = os.path.join(staging, name)
+        if os.path.getmtime(path) < cutoff:
+            os.remove(path)
@@ -0,0 +1,223 @@
+import os, time, uuid, shutil, hashlib, logging, threading
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+import catalog
+import metrics
+import media_layout
+from http_cache import json_files, etag_matches
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; the in-process locks still serialise a single worker
+    fcntl = None
+
+logger = logging.getLogger("workorder.store")
+
+HISTORY_DIRNAME = ".history"
+WORKORDER_HISTORY = int(os.getenv("WORKORDER_HISTORY", "20"))
+
+# Striped so the lock table stays fixed-size however many folders exist
+_locks = [threading.Lock() for _ in range(64)]
+
+
+def etag_of(body):
+    # Same strong ETag GET /workorder/{folder} sends, so clients can echo it back in If-Match
+    return f'"{hashlib.sha1(body).hexdigest()}"'
+
+
+def json_path(media_root, folder_name):
+    return os.path.join(media_layout.folder_path(media_root, folder_name), f"{folder_name}.json")
+
+
+def merge_patch(target, patch):
+    """RFC 7396 JSON Merge Patch: objects merge recursively, null deletes, anything else replaces."""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+class _FolderLock:
+    """Per-folder write lock: a thread lock for this process plus flock on the folder for others."""
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        self.lock = _locks[hash(os.path.basename(folder_path)) % len(_locks)]
+        self.fd = None
+
+    def __enter__(self):
+        self.lock.acquire()
+        if fcntl is not None:
+            try:
+                self.fd = os.open(self.folder_path, os.O_RDONLY)
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+            except FileNotFoundError:
+                # Deleted between the caller's check and here
+                self.__exit__(None, None, None)
+                raise HTTPException(status_code=404, detail="Workorder not found")
+            except BaseException:
+                self.__exit__(None, None, None)
+                raise
+        return self
+
+    def __exit__(self, *exc):
+        if self.fd is not None:
+            os.close(self.fd)  # releases the flock
+            self.fd = None
+        self.lock.release()
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path, body):
+    """Temp file in the same directory, fsync, rename over the target, fsync the directory.
+
+    A crash leaves either the old or the new file, never a torn one.
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _fsync_dir(os.path.dirname(path))
+    metrics.fs_written(len(body))
+
+
+def _history_dir(path):
+    return os.path.join(os.path.dirname(path), HISTORY_DIRNAME)
+
+
+def _keep_version(path, body):
+    """Copy the version being replaced into .history/, dropping the oldest beyond WORKORDER_HISTORY."""
+    if WORKORDER_HISTORY <= 0:
+        return
+    history = _history_dir(path)
+    os.makedirs(history, exist_ok=True)
+    name = f"{time.time_ns()}-{hashlib.sha1(body).hexdigest()[:12]}.json"
+    write_atomic(os.path.join(history, name), body)
+    versions = sorted(entry for entry in os.listdir(history) if entry.endswith(".json"))
+    for old in versions[:-WORKORDER_HISTORY]:
+        os.remove(os.path.join(history, old))
+
+
+def history(media_root, folder_name):
+    """Saved prior versions, newest first."""
+    path = json_path(media_root, folder_name)
+    try:
+        names = sorted((entry for entry in os.listdir(_history_dir(path)) if entry.endswith(".json")), reverse=True)
+    except FileNotFoundError:
+        names = []
+    versions = []
+    for name in names:
+        stat = os.stat(os.path.join(_history_dir(path), name))
+        versions.append({
+            "version": name.removesuffix(".json"),
+            "saved_at": int(name.split("-")[0]) / 1e9,
+            "size": stat.st_size,
+        })
+    return versions
+
+
+def read_version(media_root, folder_name, version):
+    path = os.path.join(_history_dir(json_path(media_root, folder_name)), f"{os.path.basename(version)}.json")
+    try:
+        with open(path, "rb") as f:
+            body = f.read()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Version {version!r} not found")
+    metrics.fs_read(len(body))
+    return body
+
+
+def save(db: Session, media_root, folder_name, build, if_match=None, require_match=False, files=None):
+    """Replace a work order's JSON under its folder lock and bring the catalog along.
+
+    build(current bytes) returns (new bytes, parsed document). If-Match is checked against the
+    current file inside the lock, so of two concurrent edits from the same version one gets 412.
+    files maps names in the folder to staged temp files, renamed into place only once the
+    precondition has passed; on any error they are left for the caller to delete.
+    The catalog row, rollups, change log and JSON cache are updated before the lock is released.
+    Returns the new ETag and body.
+    """
+    folder_path = media_layout.folder_path(media_root, folder_name)
+    if not os.path.isdir(folder_path):
+        raise HTTPException(status_code=404, detail="Workorder folder not found")
+    if require_match and not if_match:
+        raise HTTPException(status_code=428, detail="If-Match with the work order's ETag is required")
+
+    path = os.path.join(folder_path, f"{folder_name}.json")
+    with _FolderLock(folder_path):
+        # A delete may have removed the folder while this writer waited on the lock
+        if not os.path.isdir(folder_path):
+            raise HTTPException(status_code=404, detail="Workorder folder not found")
+        try:
+            with open(path, "rb") as f:
+                current = f.read()
+            metrics.fs_read(len(current))
+        except FileNotFoundError:
+            current = None
+
+        if if_match and not (current is not None and etag_matches(if_match, etag_of(current))):
+            raise HTTPException(
+                status_code=412,
+                detail="Work order changed since it was loaded",
+                headers={"ETag": etag_of(current)} if current is not None else None,
+            )
+
+        body, data = build(current)
+        if files:
+            for name, staged_path in files.items():
+                os.replace(staged_path, os.path.join(folder_path, name))
+            _fsync_dir(folder_path)
+        if body == current:
+            return etag_of(body), body
+        if current is not None:
+            _keep_version(path, current)
+        write_atomic(path, body)
+        json_files.discard(path)
+
+        try:
+            catalog.record_workorder(db, folder_name, path, data)
+            db.commit()
+        except Exception:
+            # The file is the source of truth; the next catalog sync picks the change up
+            db.rollback()
+            logger.exception("Catalog update failed for %s", folder_name)
+        return etag_of(body), body
+
+
+def delete(db: Session, media_root, folder_name):
+    """Remove a work order's folder under the same lock save() takes, then drop it from the catalog."""
+    folder_path = media_layout.folder_path(media_root, folder_name)
+    if not os.path.isdir(folder_path):
+        raise HTTPException(status_code=404, detail="Workorder not found")
+
+    with _FolderLock(folder_path):
+        # Another delete may have won the race while this one waited on the lock
+        if not os.path.isdir(folder_path):
+            raise HTTPException(status_code=404, detail="Workorder not found")
+        shutil.rmtree(folder_path)
+        json_files.discard(os.path.join(folder_path, f"{folder_name}.json"))
+        # A compatibility symlink left by the layout migration would now dangle
+        legacy_path = os.path.join(media_root, folder_name)
+        if os.path.islink(legacy_path):
+            os.unlink(legacy_path)
+        catalog.remove_workorder(db, folder_name)
+        db.commit()
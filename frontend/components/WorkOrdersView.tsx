@@ -66,23 +66,22 @@ export default function WorkOrdersView() {
         React.useCallback(() => {
             const fetchAllWeeks = async () => {
                 try {
-                    const res = await fetch('http://10.0.0.63:8000/workorders/');
-                    if (!res.ok) {
-                        throw new Error('Failed to fetch work orders list');
-                    }
-                    const json = await res.json();
-                    const folders = json.workorders.filter((folder: string) => /^\d{8}_\d+$/.test(folder));
-
-                    const details = await Promise.all(folders.map(async (folder: string) => {
-                        const res = await fetch(`http://10.0.0.63:8000/workorder/${folder}`);
-                        const data = res.ok ? await res.json() : null;
-                        if (data) {
-                            data.folder_name = folder;
+                    // One paged request per 500 orders instead of one request per folder
+                    const details: any[] = [];
+                    let offset: number | null = 0;
+                    while (offset !== null) {
+                        const res = await fetch(
+                            `http://10.0.0.63:8000/workorders?technician=${encodeURIComponent(user.name)}&fields=*&limit=500&offset=${offset}`
+                        );
+                        if (!res.ok) {
+                            throw new Error('Failed to fetch work orders list');
                         }
-                        return data;
-                    }));
+                        const json = await res.json();
+                        details.push(...json.workorders);
+                        offset = json.next_offset;
+                    }
 
-                    const filtered = details.filter(Boolean).filter((order: any) => order.technician === user.name);
+                    const filtered = details.filter((order: any) => /^\d{8}_\d+$/.test(order.folder_name));
 
                     // Group by updated week value
                     const grouped: { [key: string]: any[] } = {};